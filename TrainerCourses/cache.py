@@ -0,0 +1,70 @@
+from __future__ import annotations
+import json
+import time
+import sqlite3
+from pathlib import Path
+from typing import Optional,Any,Iterable
+
+#sqlite limits the number of ? in one statement, long key lists go in chunks of this many
+_CHUNK = 500
+
+class StatsCache:
+    #sqlite file next to the workbook, least recently used entries are dropped past max_entries
+    def __init__(self,pth:Path|str,max_entries:int=10000)->None:
+        self.path = Path(pth)
+        self.max_entries = max_entries
+        self._db = sqlite3.connect(self.path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value TEXT NOT NULL, used REAL NOT NULL)")
+        self._db.commit()
+        self._count = self._db.execute("SELECT COUNT(*) FROM stats").fetchone()[0]
+
+    def __str__(self)->str:
+        return f"StatsCache({self.path}, {self._count} entries)"
+
+    def get(self,key:str)->Optional[dict[str,Any]]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self,keys:Iterable[str])->dict[str,dict[str,Any]]:
+        #every hit in one transaction, their 'used' time is bumped together
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._db:
+            for first in range(0,len(keys),_CHUNK):
+                chunk = keys[first:first+_CHUNK]
+                marks = ','.join('?'*len(chunk))
+                rows = self._db.execute(f"SELECT key,value FROM stats WHERE key IN ({marks})",chunk).fetchall()
+                if rows:
+                    self._db.execute(f"UPDATE stats SET used=? WHERE key IN ({','.join('?'*len(rows))})",
+                                     (time.time(),*(key for (key,value) in rows)))
+                found.update(rows)
+        return {key:json.loads(value) for (key,value) in found.items()}
+
+    def put(self,key:str,value:dict[str,Any])->None:
+        self.put_many({key:value})
+
+    def put_many(self,items:dict[str,dict[str,Any]])->None:
+        #one transaction, the entry count is kept here instead of counting the table after every write
+        keys = list(items)
+        now = time.time()
+        with self._db:
+            for first in range(0,len(keys),_CHUNK):
+                chunk = keys[first:first+_CHUNK]
+                existing = self._db.execute(f"SELECT COUNT(*) FROM stats WHERE key IN ({','.join('?'*len(chunk))})",
+                                            chunk).fetchone()[0]
+                self._db.executemany("INSERT OR REPLACE INTO stats (key,value,used) VALUES (?,?,?)",
+                                     ((key,json.dumps(items[key]),now) for key in chunk))
+                self._count += len(chunk)-existing
+            if self._count > self.max_entries:
+                self._db.execute("DELETE FROM stats WHERE key NOT IN "+\
+                    "(SELECT key FROM stats ORDER BY used DESC LIMIT ?)",(self.max_entries,))
+                self._count = self.max_entries
+
+    def clear(self)->None:
+        with self._db:
+            self._db.execute("DELETE FROM stats")
+        self._count = 0
+
+    def close(self)->None:
+        self._db.close()
@@ -1,24 +1,43 @@
 from __future__ import annotations
-from .openpyxl_extension import open as open_xlsx,Workbook
-from typing import Optional,Any,Generator,Callable,Iterator,Iterable,ClassVar
+from typing import Optional,Any,Generator,Callable,Iterator,Iterable,ClassVar,IO,TYPE_CHECKING
 from enum import Enum
-from copy import deepcopy,copy
-from math import sqrt
-from datetime import datetime
 from pathlib import Path
-from dataclasses import dataclass,asdict
+import os
+import io
+import json
+import hashlib
+from dataclasses import dataclass,asdict,field
 from pydantic import BaseModel,validator,Extra
-from .srch import qkfltr
+from .segments import SegmentTable,SegmentFormat,SegmentBlock,TableBlock,repeat,concat,blend
+from .cache import StatsCache
+from .index import CourseIndex
+from .importer import CourseFile,find_course_files,read_course_files
+from .coursetext import TextCollection,TextSheet,TEXT_SUFFIX,read_text_file,write_text
+from .timeline import power_timeline,power_curve,normalized_power
+from .metrics import MetricPipeline,AveragePower,NormalizedPower,PowerAverages,Work,VariabilityIndex,TimeInZone,COGGAN_ZONES
+import numpy as np
+if TYPE_CHECKING:
+    #openpyxl is most of the import time, it's only loaded once a workbook is actually opened
+    from .openpyxl_extension import Workbook,ValueWorkbook
 
 
 FIT_VERSION = 2
-
-#stats.mean is slow af for this use case
-def mean(a:list[float])->float:
-    s = 0.0
-    for i in a:
-        s+=i
-    return s / len(a)
+MANIFEST_NAME = '.manifest.json'
+SNAPSHOT_VERSION = 6
+NP_WINDOW = 30
+AVERAGE_WINDOWS = (1,5,20,60)
+STATS_VERSION = 3
+#rows read from each sheet when opening lazily, enough for the merged range titles and the header row under them
+INDEX_ROWS = 10
+
+def default_metrics(ftp:float,zone_bounds:Iterable[float]=COGGAN_ZONES)->MetricPipeline:
+    #what CourseStats is built from, collections can register more on their own copy
+    return MetricPipeline([AveragePower(),
+                           NormalizedPower(NP_WINDOW),
+                           PowerAverages([60*w for w in AVERAGE_WINDOWS]),
+                           Work(),
+                           VariabilityIndex(),
+                           TimeInZone(ftp,zone_bounds)])
 
 def pathsafe(fp:str|Path|Callable)->Callable|Path|str:
     def _clean_str(s:str):
@@ -39,6 +58,89 @@ def pathsafe(fp:str|Path|Callable)->Callable|Path|str:
     else:
         return _clean_path(fp)
 
+def _umask()->int:
+    #there is no way to read the umask without setting it, so it's read once here before any writer threads start
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+_UMASK = _umask()
+
+def atomic_write(pth:Path,text:str|bytes|Callable[[IO],None])->None:
+    #write next to the target and swap it in so readers never see a half written file,
+    #a callable gets the open (text) file and streams into it itself
+    import tempfile
+    fd,tmp = tempfile.mkstemp(dir=pth.parent,prefix=f".{pth.name}.",suffix='.tmp')
+    try:
+        with os.fdopen(fd,'wb' if isinstance(text,bytes) else 'w',buffering=1<<16) as f:
+            if callable(text):
+                text(f)
+            else:
+                f.write(text)
+        #mkstemp makes the file owner only, give it the mode a plain open() would have
+        os.chmod(tmp,0o666 & ~_UMASK)
+        os.replace(tmp,pth)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def _render_course(course:Course)->tuple[Course.CourseStats,str]:
+    #runs in a worker process, the course arrives without its workbook (see CourseCollection.__getstate__)
+    return course.stats,course.erg
+
+
+def _file_category(course_file:CourseFile)->Category:
+    #exports are written to one folder per category, otherwise the description starts with it
+    candidates = []
+    if course_file.path is not None:
+        candidates.append(course_file.path.parent.name)
+    candidates.append(course_file.description)
+    for candidate in candidates:
+        candidate = candidate.strip().lower()
+        for category in Category:
+            if candidate == category.value.lower() or candidate.startswith(category.value.lower()+' '):
+                return category
+    raise Exception(f"Can't tell the category of '{course_file.name}' from its folder or description")
+
+def _open_unlinked(fp:Path)->tuple[CourseCollection.UserProfile,list[CourseCollection.UserProfile],list[Course]]:
+    #runs in a worker for open_many, what a course inserts may be in another file so nothing is linked yet
+    if fp.suffix.lower() == TEXT_SUFFIX:
+        cc = CourseCollection.open_text(fp,link=False)
+    else:
+        cc = CourseCollection.open_excel(fp,link=False)
+    return cc.user,cc.riders,list(cc._courses.values())
+
+def _text_fields(model:type[BaseModel],fields:dict[str,str])->dict[str,str]:
+    #text keys are the xlsx column names or the field names, in any case
+    keys = {k.lower():v for (k,v) in model.classkey.items()} | {k:k for k in model.__fields__}
+    unknown = [k for k in fields if k not in keys]
+    if unknown:
+        raise Exception(f"Unknown {', '.join(unknown)}, expected one of {', '.join(k.lower() for k in model.classkey)}")
+    return {keys[k]:v for (k,v) in fields.items()}
+
+def _same_cell(old:Any,new:Any)->bool:
+    #blank cells come back as None, numbers as whichever of int/float excel kept
+    if old in (None,'') or new in (None,''):
+        return old in (None,'') and new in (None,'')
+    return old == new
+
+def _cell_blocks(changes:dict[tuple[int,int],Any])->list[tuple[tuple[int,int],list[list]]]:
+    #changed cells grouped into rectangles, runs of columns in a row, stacked while the next row changed the same run
+    runs = []
+    for (row,col) in sorted(changes):
+        if runs and runs[-1][0] == row and runs[-1][2] == col-1:
+            runs[-1][2] = col
+        else:
+            runs.append([row,col,col])
+    blocks = []
+    for row,first,last in sorted(runs,key=lambda r:(r[1],r[2],r[0])):
+        values = [changes[(row,col)] for col in range(first,last+1)]
+        if blocks and blocks[-1][0][1] == first and blocks[-1][2] == last and \
+            blocks[-1][0][0]+len(blocks[-1][1]) == row:
+            blocks[-1][1].append(values)
+        else:
+            blocks.append([(row,first),[values],last])
+    return [(offset,block) for (offset,block,last) in blocks]
 
 class Templated:
     key_word_argument = None
@@ -48,7 +150,9 @@ class Templated:
     def remap(cls,**kwargs):
         d = {}
         for key,value in cls.classkey.items():
-            d[value] = kwargs[key]
+            #optional settings can be left off the sheet, the model default applies
+            if key in kwargs:
+                d[value] = kwargs[key]
         return d
 
     @classmethod
@@ -65,25 +169,102 @@ class Category(str,Enum):
 
 class CourseCollection:
     class UserProfile(BaseModel,Templated,**Templated.class_init_kwargs):
-        classkey:ClassVar[dict[str,str]] = {"Functional Threshold Power":"ftp"}
+        classkey:ClassVar[dict[str,str]] = {"Name":"name","Functional Threshold Power":"ftp","Power Zones":"zones"}
         ftp:float
+        zones:list[float]|None = None
+        name:str|None = None
 
-    def __init__(self,name:str,user:UserProfile,workbook:Workbook,workbook_path:Path)->None:
+        @validator('zones',pre=True)
+        def _split_zones(cls,v):
+            #upper bounds of zones 1-6 in % of ftp, i.e. '55,75,90,105,120,150'
+            if isinstance(v,str):
+                return [float(p) for p in v.replace(';',',').split(',') if p.strip()]
+            return v
+
+        @property
+        def zone_bounds(self)->tuple[float,...]:
+            if self.zones:
+                return tuple(p/100 for p in sorted(self.zones))
+            return COGGAN_ZONES
+
+        @property
+        def label(self)->str:
+            #folder a rider's export goes in
+            return self.name or f"FTP {self.ftp:g}"
+
+        @classmethod
+        def from_arg(cls,arg:str,zones:list[float]|None=None)->CourseCollection.UserProfile:
+            #'250' or 'Alice=250', the command line form of a Riders row
+            name,_,ftp = arg.rpartition('=')
+            return cls(ftp=ftp,name=name or None,zones=zones)
+
+    def __init__(self,name:str,user:UserProfile,workbook:Workbook|None,workbook_path:Path,
+                 analytic_stats:bool=False,stats_cache:StatsCache|None=None)->None:
         self._courses = {}
+        self._unparsed:dict[str,tuple[str,Category]] = {}
+        self._order:dict[str,int] = {}
+        self.analytic_stats = analytic_stats
+        self.stats_cache = stats_cache
+        self.metrics = default_metrics(user.ftp,user.zone_bounds)
         self.user = user
         self.name = name
-        self.workbook = workbook
+        self._workbook = workbook
+        self._source:ValueWorkbook|Workbook|None = workbook
         self.workbook_path = workbook_path
         self._path = None
+        self._riders:list[CourseCollection.UserProfile]|None = None
+        self._index:CourseIndex|None = None
+        #bumped whenever a course joins the collection, the index is rebuilt when it moves on
+        self._members = 0
+        self._indexed_members = -1
 
 
 
+    def __getstate__(self)->dict:
+        #courses are sent to export workers with their collection, leave the workbook and siblings behind
+        return self.__dict__ | {'_workbook':None,'_source':None,'_courses':{},'stats_cache':None,'_index':None}
+
+    def use_profile(self,user:UserProfile)->None:
+        #switch whose ftp the stats and files are for, anything computed for the last profile is dropped
+        self.user = user
+        #IF and TSS are indexed, they change with the ftp
+        self._index = None
+        for metric in self.metrics.metrics:
+            if isinstance(metric,TimeInZone):
+                metric.ftp,metric.bounds = user.ftp,user.zone_bounds
+        for course in self._courses.values():
+            course._stats = None
+
+    @property
+    def riders(self)->list[UserProfile]:
+        #rows of the optional Riders sheet, same columns as the User Profile on the Config sheet
+        if self._riders is None:
+            from .openpyxl_extension import open_values,ValueWorkbook
+            self._riders = []
+            if isinstance(self._source,ValueWorkbook) and self._source.head is None:
+                source = self._source
+            else:
+                source = open_values(self.workbook_path,sheets=['Riders'])
+            if 'Riders' in source.sheetnames:
+                for named_range in source['Riders'].implicit_named_ranges().values():
+                    if named_range.name == 'Riders':
+                        self._riders.extend(self.UserProfile.parse(**row) for row in named_range.list(element=dict))
+        return self._riders
+
+    @property
+    def workbook(self)->Workbook:
+        #courses are read from a read only copy, the writable workbook is only opened when something writes to it
+        if self._workbook is None:
+            from .openpyxl_extension import open as open_xlsx
+            self._workbook = open_xlsx(self.workbook_path)
+        return self._workbook
+
     @property
     def ftp(self)->float:
         return self.user.ftp
 
     def __str__(self)->str:
-        return f"CourseCollection({self.name}, {len(self._courses.keys())} Courses)"
+        return f"CourseCollection({self.name}, {len(self.course_names)} Courses)"
 
     @property
     @pathsafe
@@ -93,55 +274,334 @@ class CourseCollection:
 
     @property
     def courses(self)->Generator[Course,None,None]:
+        self._load(list(self._unparsed))
         return self._courses.values()
     @property
     def course_names(self)->list[str]:
-        return list(self._courses.keys())
+        return list(self._courses.keys())+list(self._unparsed.keys())
+
+    def _add(self,course:Course)->None:
+        self._courses[course.version_name] = course
+        self._members += 1
+
+    def _course_paths(self)->set[Path]:
+        #export paths of every course, the ones on unparsed sheets come from the index
+        return {course.path for course in self._courses.values()} | \
+            {Course._path(category,name) for (name,(title,category)) in self._unparsed.items()}
+
+    def _parse(self,names:Iterable[str])->list[Course]:
+        titles = {self._unparsed[name][0] for name in names if name in self._unparsed}
+        loaded = []
+        source = self._source
+        if titles and source.head is not None:
+            #only the top of each sheet was read to index it, the sheets in use are streamed in full now
+            from .openpyxl_extension import open_values
+            source = open_values(self.workbook_path,sheets=titles)
+        for title in titles:
+            for course in Course.excel(self,source[title]):
+                self._unparsed.pop(course.version_name,None)
+                self._courses[course.version_name] = course
+                loaded.append(course)
+        if loaded and self._order:
+            #keep workbook order no matter which sheet was asked for first
+            self._courses = dict(sorted(self._courses.items(),key=lambda kv:self._order[kv[0]]))
+        return loaded
+
+    def _load(self,names:Iterable[str])->None:
+        #parse the sheets holding these courses, linking pulls in whatever they insert before/after
+        self.link(self._parse(names))
+
+    @staticmethod
+    def _link_order(pending:dict[str,Course])->tuple[list[str],list[list[str]]]:
+        #depth first over the insert before/after graph, dependencies come out first, back edges are cycles
+        order:list[str] = []
+        cycles:list[list[str]] = []
+        state:dict[str,bool] = {}
+        deps = lambda name:[link.name for (link,pre) in pending[name]._links() if link.name in pending]
+        for root in pending:
+            if root in state:
+                continue
+            state[root] = False
+            path = [root]
+            stack = [(root,iter(deps(root)))]
+            while stack:
+                name,it = stack[-1]
+                for dep in it:
+                    if dep not in state:
+                        state[dep] = False
+                        path.append(dep)
+                        stack.append((dep,iter(deps(dep))))
+                        break
+                    elif not state[dep]:
+                        cycles.append(path[path.index(dep):]+[dep])
+                else:
+                    stack.pop()
+                    path.pop()
+                    state[name] = True
+                    order.append(name)
+        return order,cycles
+
+    def link(self,courses:Optional[Iterable[Course]]=None)->None:
+        #resolves every unlinked course (and anything it needs) in one pass, each course is linked exactly once
+        pending = {course.version_name:course for course in \
+            (self._courses.values() if courses is None else courses) if not course.linked}
+        missing = []
+        queue = list(pending.values())
+        while queue:
+            #one wave of links at a time so every sheet it needs is read in one go
+            wanted = {link.name for course in queue for (link,pre) in course._links() if link.name in self._unparsed}
+            following = []
+            #the whole sheet comes in, its other courses are linked along with the target
+            for loaded in self._parse(wanted):
+                pending[loaded.version_name] = loaded
+                following.append(loaded)
+            for course in queue:
+                for link,pre in course._links():
+                    target = self._courses.get(link.name)
+                    if target is None:
+                        missing.append(f"'{course.version_name}' inserts '{link.name}' which is not in the collection")
+                    elif not target.linked and link.name not in pending:
+                        pending[link.name] = target
+                        following.append(target)
+            queue = following
+
+        order,cycles = self._link_order(pending)
+        problems = missing + [f"circular insert {' -> '.join(cycle)}" for cycle in cycles]
+        if problems:
+            raise Exception(f"Could not link courses in '{self.name}': "+'; '.join(problems))
+        for name in order:
+            course = pending[name]
+            for link,pre in course._links():
+                course.add_linked_course(link,pre=pre)
+            course.linked = True
 
-    def filter(self,include:Optional[list[str]|str]=None,exclude:Optional[list[str]|str]=None)->Generator[Course,None,None]:
-        filtered_names = qkfltr(list(self._courses.keys()),include=include,exclude=exclude)
+    @property
+    def index(self)->CourseIndex:
+        #names and categories are indexed without parsing anything, stats only once a query needs them
+        #parsing a lazily opened sheet moves courses around but keeps the same names, only new ones need a rebuild
+        if self._index is None or self._indexed_members != self._members:
+            names = self.course_names
+            categories = [self._courses[name].category.value if name in self._courses else \
+                          self._unparsed[name][1].value for name in names]
+            self._index = CourseIndex(names,categories,lambda:self._indexed_stats(names))
+            self._indexed_members = self._members
+        return self._index
+
+    def _indexed_stats(self,names:list[str])->list[Course.CourseStats]:
+        courses = [self[name] for name in names]
+        self.compute_stats(courses)
+        return [course.stats for course in courses]
+
+    def filter(self,include:Optional[list[str]|str]=None,exclude:Optional[list[str]|str]=None,
+               where:Optional[str]=None)->Generator[Course,None,None]:
+        filtered_names = self.index.select(include=include,exclude=exclude,where=where)
         for name in filtered_names:
-            yield self._courses[name]
+            yield self[name]
+
+    def compute_stats(self,courses:Optional[Iterable[Course]]=None,force:bool=False)->None:
+        #fills course._stats for every course in one vectorized pass instead of one timeline at a time
+        courses = [course for course in (self.courses if courses is None else courses) \
+            if force or not course._stats]
+        #hashing the segments is most of a cache lookup, each key is worked out once
+        keys = {course.version_name:course.stats_key for course in courses} if self.stats_cache else {}
+        if self.stats_cache and not force:
+            todo = []
+            cached = self.stats_cache.get_many(keys.values())
+            for course in courses:
+                if hit := cached.get(keys[course.version_name]):
+                    course._stats = Course.CourseStats.from_dict(hit)
+                else:
+                    todo.append(course)
+            courses = todo
+        if not courses:
+            return
+        tables = [course.segments for course in courses]
+        for course,table,values in zip(courses,tables,self._metric_values(self.metrics,tables)):
+            course._stats = course._make_stats(values,round(table.end_time,2))
+        if self.stats_cache:
+            self.stats_cache.put_many({keys[course.version_name]:asdict(course._stats) for course in courses})
+
+    def _metric_values(self,metrics:MetricPipeline,tables:list[SegmentTable])->list[dict[str,Any]]:
+        #one dict of metric results per table, swept together or in closed form one at a time
+        if self.analytic_stats:
+            return [metrics.run_analytic(table) for table in tables]
+        values = metrics.run(tables)
+        return [{k:v[c] for (k,v) in values.items()} for c in range(len(tables))]
+
+    def save_riders(self,dst:str|Path|None,riders:Optional[Iterable[UserProfile]]=None,
+                    include:Optional[list[str]|str]=None,
+                    exclude:Optional[list[str]|str]=None,
+                    workers:int=1,
+                    force:bool=False,
+                    where:Optional[str]=None)->None:
+        #one output tree per rider from a single parse, the ftp independent metrics are swept once
+        #and only IF, TSS, zones and the header FTP change from rider to rider
+        riders = list(self.riders if riders is None else riders)
+        if not riders:
+            raise Exception(f"No riders to export for '{self.name}', add a Riders sheet or pass some ftps")
+        dst = Path(dst) if dst else self.path
+        courses = list(self.filter(include=include,exclude=exclude,where=where))
+        tables = [course.segments for course in courses]
+        metrics = MetricPipeline([metric for metric in self.metrics.metrics if not isinstance(metric,TimeInZone)])
+        for r,rider in enumerate(riders):
+            zones = TimeInZone(rider.ftp,rider.zone_bounds)
+            zones.name = f"zones-{r}"
+            metrics.register(zones)
+        shared = self._metric_values(metrics,tables)
+
+        user = self.user
+        try:
+            for r,rider in enumerate(riders):
+                self.use_profile(rider)
+                for course,table,values in zip(courses,tables,shared):
+                    values = {k:v for (k,v) in values.items() if not k.startswith('zones-')} | \
+                        {'zones':values[f"zones-{r}"]}
+                    course._stats = course._make_stats(values,round(table.end_time,2))
+                print(f"Rider {rider.label} (FTP {rider.ftp:g})")
+                self.save(dst / rider.label,include,exclude,workers=workers,force=force,where=where)
+        finally:
+            self.use_profile(user)
+
+    def _library_rows(self)->list[list]:
+        #what the Library sheet holds now, streamed read only unless the writable workbook is already open
+        if self._workbook is not None:
+            return [list(row) for row in self._workbook['Library'].iter_rows(values_only=True)]
+        from .openpyxl_extension import open_values,ValueWorkbook
+        if isinstance(self._source,ValueWorkbook) and self._source.head is None and \
+            'Library' in self._source.sheetnames:
+            source = self._source
+        else:
+            source = open_values(self.workbook_path,sheets=['Library'])
+        return [list(row) for row in source['Library'].iter_rows()]
 
-    def build_library(self,no_save:bool=False)->None:
+    def build_library(self,no_save:bool=False)->bool:
+        #only cells whose value changed are written, the workbook isn't even opened when nothing did
+        self.compute_stats()
         courses = {d['name']:{k.title():v for (k,v) in d.items()} | {'Sport':'Bike Indoor'} \
             for d in [course.dict() for course in self]}
-        
-        if courses:
-            existing = {}
-            sheet = self.workbook.get_sheet_by_name('Library')
-            rows = list(sheet.iter_rows())
-            col_key = {cell.value:col+1 for (col,cell) in enumerate(rows.pop(0))}
-            name_index = col_key['Name']
-            max_row = 1
-            for rc,row in enumerate(rows):
-                if row[name_index-1].value:
-                    existing[row[name_index-1].value] = rc+2
-                    max_row+=1
-                else:
-                    break
-            for course_name,course in courses.items():
-                
-                course_row = existing.get(course_name)
-                if not course_row:
-                    max_row+=1
-                    course_row = max_row
-                    print(f"Adding {course}")
-                for key,value in course.items():
-                    sheet.cell(row=course_row,column=col_key[key]).value = value
-                    #print(f"Would set {(course_row,colclasskey[key])} to {value} for {course_name}")
-            if not no_save:
-                self.workbook.save(filename=self.workbook_path)
+        if not courses:
+            return False
+
+        rows = self._library_rows()
+        changes = {}
+        col_key = {value:col+1 for (col,value) in enumerate(rows[0] if rows else []) if value}
+        #metrics the sheet hasn't seen yet get a column on the end
+        for key in next(iter(courses.values())):
+            if key not in col_key:
+                col_key[key] = max(col_key.values(),default=0)+1
+                changes[(1,col_key[key])] = key
+        name_index = col_key['Name']
+        existing = {}
+        max_row = 1
+        for rc,row in enumerate(rows[1:]):
+            if name_index <= len(row) and row[name_index-1]:
+                existing[row[name_index-1]] = rc+2
+                max_row+=1
+            else:
+                break
+        for course_name,course in courses.items():
+            course_row = existing.get(course_name)
+            current = []
+            if course_row:
+                current = rows[course_row-1]
+            else:
+                max_row+=1
+                course_row = max_row
+                print(f"Adding {course}")
+            for key,value in course.items():
+                col = col_key[key]
+                old = current[col-1] if col <= len(current) else None
+                if not _same_cell(old,value):
+                    changes[(course_row,col)] = value
+
+        if not changes:
+            print('Library is up to date')
+            return False
+        sheet = self.workbook['Library']
+        for offset,block in _cell_blocks(changes):
+            sheet.write_rows(block,offset=offset)
+        print(f"Updated {len(changes)} Library cells")
+        if not no_save:
+            self.workbook.save(filename=self.workbook_path)
+        return True
+
+    @property
+    def stats_cache_path(self)->Path:
+        return self.workbook_path.with_suffix('.stats.db')
+
+    @property
+    def snapshot_path(self)->Path:
+        return self.workbook_path.with_suffix('.snapshot')
+
+    @staticmethod
+    def _source_signature(fp:Path)->dict:
+        stat = fp.stat()
+        with open(fp,'rb') as f:
+            sha1 = hashlib.sha1(f.read()).hexdigest()
+        return {'mtime':stat.st_mtime_ns,'size':stat.st_size,'sha1':sha1}
+
+    def write_snapshot(self)->None:
+        #plain data only, a json header and the linked segment columns of every course back to back, loading it
+        #never runs anything from the file and doesn't care how the classes are laid out
+        courses = list(self.courses)
+        tables = [course.segments for course in courses]
+        segments = SegmentTable.concat(tables) if tables else SegmentTable([],[],[],[],[])
+        header = {'version':SNAPSHOT_VERSION,
+                  'source':self._source_signature(self.workbook_path),
+                  'name':self.name,
+                  'user':self.user.dict(),
+                  'courses':[course.snapshot() for course in courses]}
+        buffer = io.BytesIO()
+        np.savez(buffer,header=np.array(json.dumps(header)),lengths=np.array([len(t) for t in tables],dtype=np.int64),
+                 **{k:getattr(segments,k) for k in SegmentTable.__slots__[:-1]})
+        atomic_write(self.snapshot_path,buffer.getvalue())
 
     @classmethod
-    def open_excel(cls,fp:Path|str)->CourseCollection:
-        reserved_sheets = ('config','schedule','library')
+    def open_snapshot(cls,fp:Path|str,cache:bool=False)->CourseCollection|None:
+        #None when there is no snapshot or the xlsx changed since it was written
+        fp = Path(fp)
+        try:
+            with np.load(fp.with_suffix('.snapshot'),allow_pickle=False) as data:
+                header = json.loads(data['header'].item())
+                lengths = data['lengths']
+                columns = [data[k] for k in SegmentTable.__slots__[:-1]]
+            stat = fp.stat()
+            if header.get('version') != SNAPSHOT_VERSION:
+                return None
+            source = header['source']
+        except Exception:
+            #missing, truncated or not a snapshot at all, a snapshot is only ever a shortcut
+            return None
+        if (stat.st_mtime_ns,stat.st_size) != (source['mtime'],source['size']):
+            #touched but maybe not edited, fall back to the content hash
+            if cls._source_signature(fp)['sha1'] != source['sha1']:
+                return None
+        try:
+            inst = cls(name=header['name'],user=cls.UserProfile(**header['user']),workbook=None,workbook_path=fp)
+            starts = np.cumsum(lengths)-lengths
+            for entry,start,length in zip(header['courses'],starts.tolist(),lengths.tolist(),strict=True):
+                table = SegmentTable(*[column[start:start+length] for column in columns])
+                inst._add(Course.from_snapshot(inst,entry,table))
+        except Exception:
+            return None
+        if cache:
+            inst.stats_cache = StatsCache(inst.stats_cache_path)
+        return inst
+
+    @classmethod
+    def open_excel(cls,fp:Path|str,cache:bool=False,snapshot:bool=False,lazy:bool=False,
+                   link:bool=True)->CourseCollection:
+        reserved_sheets = ('config','schedule','library','riders')
         output = {}
         fp = Path(fp)
         init_key = {"User Profile":("user",cls.UserProfile)}
+        if snapshot and (inst := cls.open_snapshot(fp,cache=cache)):
+            return inst
         if fp.exists():
+            from .openpyxl_extension import open_values
             name = fp.stem
-            wb = open_xlsx(fp)
+            #lazily only the top of each course sheet is read, enough to index it, Config is always read whole
+            wb = open_values(fp,head=INDEX_ROWS if lazy else None,full=['Config'])
             config_sheet = wb['Config']
             kwargs = {"name":name}
             for named_range in config_sheet.implicit_named_ranges().values():
@@ -153,38 +613,210 @@ class CourseCollection:
                         kwarg = init_key[named_range.name]
                     kwargs[kwarg] = value 
 
-            inst = cls(workbook=wb,workbook_path=fp,**kwargs)
+            inst = cls(workbook=None,workbook_path=fp,**kwargs)
+            inst._source = wb
+            if cache:
+                inst.stats_cache = StatsCache(inst.stats_cache_path)
 
             
             for name in wb.sheetnames:
                 sheet = wb[name]
                 if sheet.title.lower() not in reserved_sheets:
-                    for course in Course.excel(inst,sheet):
-                        inst._courses[course.version_name] = course
-            for course in inst.courses:
-                course.link()
+                    if lazy:
+                        #only the header is read now, the sheet is parsed the first time one of its courses is used
+                        for version_name,category in Course.excel_index(sheet).items():
+                            inst._unparsed[version_name] = (sheet.title,category)
+                            inst._order[version_name] = len(inst._order)
+                        inst._members += 1
+                    else:
+                        for course in Course.excel(inst,sheet):
+                            inst._add(course)
+            if not link:
+                #open_many links once every workbook is in
+                return inst
+            inst.link()
+            if snapshot and not lazy:
+                inst.write_snapshot()
             return inst
         else:
             raise Exception(f"File does not exist : {fp}")
 
+    @classmethod
+    def open_text(cls,fp:Path|str,cache:bool=False,link:bool=True)->CourseCollection:
+        #a .courses file, sections become courses the way sheets do without going near a workbook
+        fp = Path(fp)
+        if not fp.exists():
+            raise Exception(f"File does not exist : {fp}")
+        text = read_text_file(fp)
+        inst = cls(name=fp.stem,user=cls.UserProfile(**_text_fields(cls.UserProfile,text.config)),
+                   workbook=None,workbook_path=fp)
+        inst._riders = [cls.UserProfile(**rider) for rider in text.riders]
+        if cache:
+            inst.stats_cache = StatsCache(inst.stats_cache_path)
+        for sheet in text.sheets:
+            try:
+                courses = Course.text(inst,sheet)
+            except Exception as e:
+                raise Exception(f"{fp.name}:{sheet.line}: [{sheet.title}] {e}")
+            for course in courses:
+                inst._add(course)
+        if link:
+            inst.link()
+        return inst
+
+    @classmethod
+    def open_many(cls,paths:Iterable[Path|str],workers:int=1,cache:bool=False,
+                  name:Optional[str]=None)->CourseCollection:
+        #xlsx and .courses files parsed side by side then merged into one collection, the first file has the
+        #say on the user profile and on any course name that turns up twice, links are resolved across files
+        paths = [Path(fp) for fp in paths]
+        if not paths:
+            raise Exception("No collections to open")
+        missing = [str(fp) for fp in paths if not fp.exists()]
+        if missing:
+            raise Exception(f"File does not exist : {', '.join(missing)}")
+        unsupported = [str(fp) for fp in paths if fp.is_dir() or fp.suffix.lower() not in ('.xlsx',TEXT_SUFFIX)]
+        if unsupported:
+            raise Exception(f"open_many reads .xlsx and {TEXT_SUFFIX} collections, use open_erg for : {', '.join(unsupported)}")
+        if workers <= 1 or len(paths) <= 1:
+            opened = [_open_unlinked(fp) for fp in paths]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=min(workers,len(paths))) as readers:
+                opened = list(readers.map(_open_unlinked,paths))
+        user = opened[0][0]
+        if name is None:
+            name = paths[0].stem if len(paths) == 1 else Path(os.path.abspath(paths[0])).parent.name
+        inst = cls(name=name,user=user,workbook=None,workbook_path=paths[0])
+        inst._riders = []
+        if cache:
+            inst.stats_cache = StatsCache(inst.stats_cache_path)
+        conflicts = []
+        owner:dict[str,Path] = {}
+        for fp,(profile,riders,courses) in zip(paths,opened):
+            if (profile.ftp,profile.zone_bounds) != (user.ftp,user.zone_bounds):
+                conflicts.append(f"{fp.name} is set up for FTP {profile.ftp:g}, "
+                                 f"every course is scored with {paths[0].name}'s FTP {user.ftp:g}")
+            inst._riders.extend(rider for rider in riders if rider not in inst._riders)
+            for course in courses:
+                if course.version_name in inst._courses:
+                    conflicts.append(f"'{course.version_name}' is in {owner[course.version_name].name} and {fp.name}, "
+                                     f"keeping the one from {owner[course.version_name].name}")
+                    continue
+                course.collection = inst
+                owner[course.version_name] = fp
+                inst._add(course)
+        for conflict in conflicts:
+            print('Conflict:',conflict)
+        inst.link()
+        return inst
+
+    @classmethod
+    def xlsx_to_text(cls,src:str|Path,dst:str|Path|None=None)->Path:
+        #writes the workbook's courses as a .courses file, rows are copied as they are, nothing is expanded
+        src = Path(src)
+        dst = Path(dst) if dst else src.with_suffix(TEXT_SUFFIX)
+        cc = cls.open_excel(src,lazy=True)
+        user = cc.user
+        text = TextCollection(config={'ftp':f"{user.ftp:g}"})
+        if user.zones:
+            text.config['zones'] = ','.join(f"{z:g}" for z in user.zones)
+        if user.name:
+            text.config['name'] = user.name
+        for rider in cc.riders:
+            text.riders.append({'name':rider.name,'ftp':f"{rider.ftp:g}",
+                                'zones':','.join(f"{z:g}" for z in rider.zones) if rider.zones else None})
+        titles = list(dict.fromkeys(title for (title,category) in cc._unparsed.values()))
+        from .openpyxl_extension import open_values
+        source = open_values(src,sheets=titles)
+        for title in titles:
+            text.sheets.append(Course.text_sheet(source[title]))
+        atomic_write(dst,lambda f:write_text(f,text))
+        return dst
+
+    @classmethod
+    def open_erg(cls,src:Path|str|Iterable[Path|str],ftp:Optional[float]=None,workers:int=1,
+                 cache:bool=False)->CourseCollection:
+        #.erg/.mrc files or whole folders of them, i.e. an earlier export, parsed in 'workers' processes
+        src = [src] if isinstance(src,(str,Path)) else list(src)
+        paths = find_course_files(src)
+        if not paths:
+            raise Exception(f"No .erg or .mrc files in : {src}")
+        if workers <= 1 or len(paths) <= 1:
+            parsed = read_course_files(paths)
+        else:
+            chunksize = max(1,len(paths)//(4*workers))
+            chunks = [paths[i:i+chunksize] for i in range(0,len(paths),chunksize)]
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers) as readers:
+                parsed = [course_file for part in readers.map(read_course_files,chunks) for course_file in part]
+        files = []
+        for course_file in parsed:
+            if isinstance(course_file,str):
+                print('Skipping',course_file)
+            else:
+                files.append(course_file)
+        if ftp is None:
+            ftp = next((course_file.ftp for course_file in files if course_file.ftp),None)
+            if ftp is None:
+                raise Exception(f"No FTP in any file header, pass one to open {src}")
+        root = Path(src[0]) if len(src) == 1 else Path(os.path.commonpath([os.path.abspath(pth) for pth in src]))
+        inst = cls(name=root.stem,user=cls.UserProfile(ftp=ftp),workbook=None,workbook_path=root)
+        #there is no workbook, so no Riders sheet either
+        inst._riders = []
+        if cache:
+            inst.stats_cache = StatsCache(inst.stats_cache_path)
+        for course_file in files:
+            try:
+                course = Course.from_file(inst,course_file)
+            except Exception as e:
+                print('Skipping',f"{course_file.path}: {e}")
+                continue
+            if course.version_name in inst._courses:
+                print('Skipping',f"{course_file.path}: '{course.version_name}' was already read from another file")
+                continue
+            inst._add(course)
+        return inst
+
     def summary(self,stats:bool=False,
                 include:Optional[list[str]|str]=None,
-                exclude:Optional[list[str]|str]=None)->str:
+                exclude:Optional[list[str]|str]=None,
+                where:Optional[str]=None)->str:
         parts = [f"{self}"]
-        for course in self.filter(include,exclude):
+        courses = list(self.filter(include,exclude,where))
+        if stats:
+            self.compute_stats(courses)
+        for course in courses:
             parts.append(course.summary(stats).replace('\n','\n\t'))           
         return '\n\t'.join(parts)
 
     @classmethod
     def xlsx_to_erg(cls,src:str|Path,dst:str|Path|None=None,
                     include:Optional[list[str]|str]=None,
-                    exclude:Optional[list[str]|str]=None)->None:
+                    exclude:Optional[list[str]|str]=None,
+                    workers:int=1,
+                    force:bool=False)->None:
         cc = cls.open_excel(src)
-        cc.save(dst,include,exclude)
+        cc.save(dst,include,exclude,workers=workers,force=force)
+
+    @staticmethod
+    def _read_manifest(dst:Path)->dict[str,str]:
+        try:
+            with open(dst / MANIFEST_NAME) as f:
+                return json.load(f)
+        except (OSError,ValueError):
+            return {}
+
+    @staticmethod
+    def _write_manifest(dst:Path,manifest:dict[str,str])->None:
+        atomic_write(dst / MANIFEST_NAME,json.dumps(manifest,indent=1,sort_keys=True))
 
     def save(self,dst:str|Path|None,
              include:Optional[list[str]|str]=None,
-             exclude:Optional[list[str]|str]=None):
+             exclude:Optional[list[str]|str]=None,
+             workers:int=1,
+             force:bool=False,
+             where:Optional[str]=None):
         if not dst:
             dst = self.path
         else:
@@ -192,14 +824,55 @@ class CourseCollection:
         if not dst.exists():
             dst.mkdir(parents=True)
 
-        for course in self.filter(include=include,exclude=exclude):
-            course.save(dst)
+        old_manifest = self._read_manifest(dst)
+        #only files whose course left the collection are stale, filtered out courses keep theirs
+        current = {pth.as_posix() for pth in self._course_paths()}
+        for stale in set(old_manifest) - current:
+            pth = dst / stale
+            if pth.exists():
+                print('Removing',pth)
+                pth.unlink()
+                try:
+                    pth.parent.rmdir()
+                except OSError:
+                    pass
+        manifest = {k:v for (k,v) in old_manifest.items() if k in current}
+
+        courses = []
+        for course in self.filter(include=include,exclude=exclude,where=where):
+            key = course.path.as_posix()
+            fingerprint = course.fingerprint
+            if force or manifest.get(key) != fingerprint or not (dst / course.path).exists():
+                courses.append(course)
+            manifest[key] = fingerprint
+
+        if workers <= 1 or len(courses) <= 1:
+            self.compute_stats(courses)
+            for course in courses:
+                course.save(dst)
+        else:
+            #stats and rendering are cpu bound so they go to processes, writing is left to threads
+            from concurrent.futures import ProcessPoolExecutor,ThreadPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers) as renderers,\
+                ThreadPoolExecutor(max_workers=workers) as writers:
+                writes = []
+                chunksize = max(1,len(courses)//(4*workers))
+                for course,(stats,erg) in zip(courses,renderers.map(_render_course,courses,chunksize=chunksize)):
+                    course._stats = stats
+                    writes.append(writers.submit(course.save,dst,erg))
+                if self.stats_cache:
+                    self.stats_cache.put_many({course.stats_key:asdict(course._stats) for course in courses})
+                for write in writes:
+                    write.result()
+        self._write_manifest(dst,manifest)
 
     def __getitem__(self,name:str)->Course:
+        if name in self._unparsed:
+            self._load([name])
         return self._courses[name]
 
     def __iter__(self)->Generator:
-        for c in self._courses.values():
+        for c in self.courses:
             yield c
 
 
@@ -208,6 +881,10 @@ class Course:
         def __str__(self)->str:
             return '{'+', '.join([f"{k}'@{int(v)}W" for (k,v) in self.items() if v]) + '}'
 
+    class CourseZones(dict):
+        def __str__(self)->str:
+            return '{'+', '.join([f"Z{k} {v}'" for (k,v) in self.items() if v]) + '}'
+
     @dataclass
     class CourseStats:
         time:float
@@ -215,10 +892,25 @@ class Course:
         np:float
         ftpif:float
         tss:int
+        kj:int
+        vi:float
         power_averages:CoursePowerAverages
+        zones:CourseZones
+        extra:dict[str,Any] = field(default_factory=dict)
+
+        def fields(self)->dict[str,Any]:
+            #registered plugin metrics sit next to the built in ones
+            return {k:v for (k,v) in self.__dict__.items() if k != 'extra'} | self.extra
 
         def __str__(self)->str:
-            return ', '.join([f"{k}={v}" for (k,v) in asdict(self).items()])
+            return ', '.join([f"{k}={v}" for (k,v) in self.fields().items()])
+
+        @classmethod
+        def from_dict(cls,d:dict)->Course.CourseStats:
+            #json turns the minute keys into strings
+            pa = Course.CoursePowerAverages({int(k):v for (k,v) in d['power_averages'].items()})
+            zones = Course.CourseZones({int(k):v for (k,v) in d['zones'].items()})
+            return cls(**(d | {'power_averages':pa,'zones':zones}))
 
 
 
@@ -244,7 +936,7 @@ class Course:
         template_name = "Insert After"
 
     
-    class CourseSegment(BaseModel,Templated,**Templated.class_init_kwargs):
+    class CourseSegment(BaseModel,Templated,SegmentFormat,**Templated.class_init_kwargs):
         classkey:ClassVar[dict[str,str]] = {"Time":"time",
                 "Power":"power_start",
                 "Ramp-to Power":"ramp_to",
@@ -258,53 +950,6 @@ class Course:
         exclude:bool|None = None
         start_time:float = 0.0
 
-        @property
-        def end_time(self)->float:
-            return self.start_time+self.time
-
-
-        @property
-        def power_end(self)->int:
-            if self.ramp_to:
-                return self.ramp_to
-            return self.power_start
-
-        @staticmethod
-        def _erg_fmt(i:float|int)->int|float:
-            if i % 1 == 0:
-                return int(i)
-            else:
-                return round(i,1)
-
-        @property
-        def power(self):
-            if self.power_end:
-                return mean([self.power_start,self.power_end])
-            return self.power_start
-
-
-        @property
-        def erg(self)->str:
-            return f"{self._erg_fmt(self.start_time)}\t{int(self.power_start)}\n"+\
-                f"{self._erg_fmt(self.start_time+self.time)}\t{int(self.power_end)}"
-        
-        def __str__(self)->str:
-            parts = [self._time_str(),"@",str(int(self.power_start)),'W']
-            if self.ramp_to:
-                parts.extend(['->',str(int(self.ramp_to)),'W'])
-
-            return ''.join(parts)
-
-        def _time_str(self)->str:
-            minutes,min_frac = divmod(self.time,1)
-            mntmp = []
-            if minutes:
-                mntmp.extend([str(int(minutes)),"'"])
-            if min_frac:
-                mntmp.extend([str(int(min_frac*60)),'"'])
-      
-            return ''.join(mntmp)
-
     _sections = {section_type.template_name:section_type for section_type in \
                 (Header,PrependedCourse,AppendedCourse,CourseSegment)}
 
@@ -314,7 +959,7 @@ class Course:
                  name:str,
                  version:int,
                  versioned:bool,
-                 course_data:list[CourseSegment]|None = None,
+                 course_data:list[CourseSegment]|SegmentTable|None = None,
                  prepend:list[PrependedCourse]|None=None,
                  append:list[AppendedCourse]|None=None)->None:
         self.collection = collection
@@ -325,7 +970,8 @@ class Course:
         self.versioned = versioned
         self.prepend:list[Course] = []
         self.append:list[Course] = []
-        self.segments:list[CourseSegment] = []
+        #excel rows stop at the boundary, courses are built from shared blocks that are only expanded on demand
+        self._block = TableBlock(SegmentTable.from_segments([]))
         self._prepend_names = prepend
         self._append_names = append
         self._norm_power:float|None = None
@@ -333,26 +979,37 @@ class Course:
 
         self.linked = False
         if course_data:
-            for repeat in range(self.version):               
-                self.segments.extend(deepcopy(course_data))
-            #recalc to make segments sortable and hashable by total time
-            self._recalc_segment_time()
-            for seg in list(reversed(self.segments)):
-                if seg.exclude:
-                    self.segments.remove(seg)
-                else:
-                    break
-            self._recalc_segment_time()
- 
+            if not isinstance(course_data,SegmentTable):
+                course_data = SegmentTable.from_segments(course_data)
+            self._block = repeat(TableBlock(course_data),self.version)
+
+    @property
+    def _block(self)->SegmentBlock:
+        return self._segment_block
+
+    @_block.setter
+    def _block(self,block:SegmentBlock)->None:
+        #the expanded table is kept until the course's blocks change
+        self._segment_block = block
+        self._segments = None
+
+    @property
+    def segments(self)->SegmentTable:
+        if self._segments is None:
+            segments = self._block.table()
+            for k in SegmentTable.__slots__:
+                getattr(segments,k).flags.writeable = False
+            self._segments = segments
+        return self._segments
 
     def add_segment(self,seg:CourseSegment)->None:
-        if self.segments:
-            seg.start_time = self.segments[-1].start_time + seg.time
-        self.segments.append(seg)
+        self._block = concat(self._block,TableBlock(SegmentTable.from_segments([seg])))
 
     def dict(self)->dict:
         stats = asdict(self.stats)
         p_ave = {f"{k}M avg":v for (k,v) in stats.pop('power_averages').items()}
+        p_ave |= {f"Z{k} min":v for (k,v) in stats.pop('zones').items()}
+        stats |= stats.pop('extra')
         return {'name':self.version_name,
                 'category':self.category.value} | stats | p_ave |\
                     {'comments':self.comments}
@@ -368,78 +1025,84 @@ class Course:
                 parts.append(f'\t{segment}')
         return '\n'.join(parts)
 
+    def _links(self)->list[tuple[PrependedCourse|AppendedCourse,bool]]:
+        return [(link,True) for link in self._prepend_names or []]+\
+            [(link,False) for link in self._append_names or []]
+
     def link(self):
         if not self.linked:
-            for course_link in self._prepend_names:
-                self.add_linked_course(course_link,pre=True)
-            for course_link in self._append_names:
-                self.add_linked_course(course_link,pre=False)
-            if self._append_names or self._prepend_names:
-                self._recalc_segment_time()
-            self.linked=True
+            self.collection.link([self])
 
 
-    def add_linked_course(self,linked_course:str,pre:bool=False)->None:
-        try:
-            lc = self.collection[linked_course.name]
-        except KeyError as ke:
-            raise Exception(f"Could not find course '{linked_course.name}' to link to course '{self.name}' in "+\
-                f"{','.join(list(self.collection.course_names))}.")
-        if not lc.linked:
-            lc.link()
+    def add_linked_course(self,linked_course:PrependedCourse|AppendedCourse,pre:bool=False)->None:
+        #the linked course must already be resolved, CourseCollection.link takes care of the order
+        lc = self.collection[linked_course.name]
         if pre:
-            segs = [deepcopy(lc.segments),self.segments]
+            blocks = [lc._block,self._block]
         else:
-            segs = [self.segments,deepcopy(lc.segments)]
+            blocks = [self._block,lc._block]
 
         if linked_course.blend:
-            p1=segs[0][-1].power_end
-            p2=segs[1][0].power_start
+            p1=blocks[0].power_last
+            p2=blocks[1].power_first
             if p2!=p1:
-                segs[0].append(self.CourseSegment(time=round(linked_course.blend/60.00,2),
-                                                  power_start=p1,
-                                                  ramp_to=p2))
-        self.segments = segs[0] + segs[1]
+                blocks.insert(1,blend(round(linked_course.blend/60.00,2),p1,p2))
+        self._block = concat(*blocks)
+
+    @property
+    def fingerprint(self)->str:
+        #everything that ends up in the rendered file, the stats through the same settings their cache key uses
+        #(segments, ftp, zones, metrics) so a change to any of them re-exports the file
+        header = [FIT_VERSION,self.version_name,self.category.value,self.comments,self.file_name]
+        return hashlib.sha1(json.dumps([header,self.stats_key]).encode()).hexdigest()
 
     @property
     def file_name(self)->str:
         return f"{self.name}.erg"
 
+    @staticmethod
+    def _version_name(name:str,version:int,versioned:bool)->str:
+        if version == 1 and not versioned:
+            return name
+        else:
+            return name+'-'+str(version)+'x'
+
     @property
     def version_name(self)->str:       
-        if self.version == 1 and not self.versioned:
-            return self.name
-        else:
-            return self.name+'-'+str(self.version)+'x'
+        return self._version_name(self.name,self.version,self.versioned)
 
     @property
     def description(self)->str:
-        return f"{self.category.value} {' '.join([k+'='+str(v) for (k,v) in self.stats.__dict__.items()])}"
+        return f"{self.category.value} {' '.join([k+'='+str(v) for (k,v) in self.stats.fields().items()])}"
 
     @property
     def erg(self)->str:
+        buffer = io.StringIO()
+        self.write_erg(buffer)
+        return buffer.getvalue()
+
+    def write_erg(self,stream:IO[str],batch:int=4096)->None:
+        #header and segment lines go straight to any text stream, no whole file string is built
         parts = [f"[COURSE HEADER]",f"VERSION = {FIT_VERSION}",
                  "UNITS = ENGLISH",f"DESCRIPTION = {self.description}",
                  f"FILE NAME = {self.file_name}",
                  f"FTP = {int(self.collection.ftp)}",
                  "MINUTES WATTS",
-                 "[END COURSE HEADER]","[COURSE DATA]",'\n'.join([seg.erg for seg in self]),
-                 "[END COURSE DATA]"]
-        return '\n'.join(parts)
-
-    def _recalc_segment_time(self):
-
-        for i in range(1,len(self.segments)):
-            self.segments[i].start_time = self.segments[i-1].start_time + self.segments[i-1].time
-
-    def power_by_second(self)->list[int]:
-        power_by_seconds = []
-        for count,seg in enumerate(self.segments):
-            second_range = int(round(60*seg.time,0))
-            diff = seg.power_end-seg.power_start
-            for second in range(second_range):
-                power_by_seconds.append(seg.power_start+second/second_range*diff)
-        return power_by_seconds
+                 "[END COURSE HEADER]","[COURSE DATA]"]
+        stream.write('\n'.join(parts)+'\n')
+        for c,chunk in enumerate(self.segments.erg_chunks(batch)):
+            if c:
+                stream.write('\n')
+            stream.write(chunk)
+        stream.write('\n[END COURSE DATA]')
+
+    def _segment_rows(self)->list[list[float]]:
+        segments = self.segments
+        return list(zip(segments.time.tolist(),segments.power_start.tolist(),
+                        segments.power_end.tolist()))
+
+    def power_by_second(self)->np.ndarray:
+        return power_timeline(self.segments)
 
     def __str__(self)->str:
         return f"Course({self.version_name}, {self.stats}, comments = {self.comments})"
@@ -447,94 +1110,112 @@ class Course:
         return f"Course({self.version_name}-{round(self.total_time())}')"
     
     def total_time(self)->float:
-        if self.segments:
-            return round(self.segments[-1].end_time,2)
-        return 0.00
+        return round(self.segments.end_time,2)
+
+    def power_curve(self,durations:Iterable[int]|None=None)->np.ndarray:
+        return power_curve(self.power_by_second(),durations)
+
+    def normalized_power(self,window:int=NP_WINDOW,exponential:bool=False)->float:
+        return normalized_power(self.power_by_second(),window,exponential)
 
     @staticmethod
-    def power_for_time(t:int,pbs:list[int])->int|None:
-      
-        ts = 60*t
-        lpbs = len(pbs)
-    
-        if lpbs>=ts:
-            max = 0
-            for c in range(lpbs - ts):
-                avg = mean(pbs[c:c+ts])
-                if avg > max:
-                    max = avg
-            return int(max)
+    def power_for_time(t:int,pbs:np.ndarray)->int|None:
+        p = power_curve(pbs,(60*t,))[0]
+        if not np.isnan(p):
+            return int(p)
 
+    @property
+    def stats_key(self)->str:
+        #only what the numbers depend on, the same segments under another name share an entry
+        settings = [STATS_VERSION,NP_WINDOW,self.collection.ftp,self.collection.analytic_stats,
+                    self.collection.user.zone_bounds,
+                    [metric.name for metric in self.collection.metrics.metrics]]
+        return hashlib.sha1(json.dumps([settings,self._segment_rows()]).encode()).hexdigest()
 
     @property
     def stats(self)->CourseStats:
         if not self._stats:
-            window_size = 30 
-            total_time = self.total_time()
-            pbs = self.power_by_second()
-            moving_averages = []
-            i = 0
-            while i < len(pbs) - window_size + 1:
-                this_window = pbs[i : i + window_size]
-                window_average = sum(this_window) / window_size
-                moving_averages.append(window_average ** 4)
-                i += 1
-            norm_power = round(mean(moving_averages) ** (1/4),2)
-            intensity = round(norm_power / self.collection.ftp,2)
-            tss = int((total_time * 60 * norm_power
-                    * intensity) / (self.collection.ftp * 3600.0) * 100)
-
-            pa = self.CoursePowerAverages()
-            for average_window in (1,5,20,60):               
-                pa[average_window] = self.power_for_time(average_window,pbs)
-
-            self._stats = self.CourseStats(time = int(total_time),
-                              average = round(mean(pbs),2),
-                              np = norm_power,
-                              ftpif = intensity,
-                              tss = tss,
-                              power_averages = pa)
+            cache = self.collection.stats_cache
+            if cache:
+                key = self.stats_key
+                if cached := cache.get(key):
+                    self._stats = self.CourseStats.from_dict(cached)
+                else:
+                    self._stats = self.compute_stats(analytic=self.collection.analytic_stats)
+                    cache.put(key,asdict(self._stats))
+            else:
+                self._stats = self.compute_stats(analytic=self.collection.analytic_stats)
         return self._stats
 
+    def compute_stats(self,analytic:bool=False)->CourseStats:
+        metrics = self.collection.metrics
+        if analytic:
+            values = metrics.run_analytic(self.segments)
+        else:
+            values = {k:v[0] for (k,v) in metrics.run([self.segments]).items()}
+        return self._make_stats(values)
+
+    def _make_stats(self,values:dict[str,Any],total_time:Optional[float]=None)->CourseStats:
+        #values holds one course's worth of metric results, anything not built in goes to extra
+        values = dict(values)
+        if total_time is None:
+            total_time = self.total_time()
+        norm_power = round(float(values.pop('np')),2)
+        intensity = round(norm_power / self.collection.ftp,2)
+        tss = int((total_time * 60 * norm_power
+                * intensity) / (self.collection.ftp * 3600.0) * 100)
+
+        pa = self.CoursePowerAverages({w:None if np.isnan(p) else int(p) \
+            for (w,p) in zip(AVERAGE_WINDOWS,values.pop('power_averages'))})
+
+        return self.CourseStats(time = int(total_time),
+                          average = round(float(values.pop('average')),2),
+                          np = norm_power,
+                          ftpif = intensity,
+                          tss = tss,
+                          kj = int(round(float(values.pop('kj')))),
+                          vi = round(float(values.pop('vi')),2),
+                          power_averages = pa,
+                          zones = self.CourseZones({z+1:round(float(seconds)/60,1) \
+                                                    for (z,seconds) in enumerate(values.pop('zones'))}),
+                          extra = {k:v.tolist() if isinstance(v,(np.ndarray,np.generic)) else v \
+                                   for (k,v) in values.items()})
+
 
     def __iter__(self):
         for s in self.segments:
             yield s
 
+    @staticmethod
+    def _path(category:Category,version_name:str)->Path:
+        return (Path(pathsafe(category)) / pathsafe(version_name)).with_suffix('.erg')
+
     @property
     def path(self)->Path:
-        return (Path(pathsafe(self.category)) / pathsafe(self.version_name)).with_suffix('.erg')
+        return self._path(self.category,self.version_name)
 
-    def save(self,col_pth:Optional[Path]=None):
+    def save(self,col_pth:Optional[Path]=None,erg:Optional[str]=None):
         if not col_pth:
             pth = self.collection.path / self.path
         else:
             pth = col_pth / self.path
-        if not pth.parent.exists():
-            pth.parent.mkdir(parents=True)
-        with open(pth,'w') as f:
-            print('Saving',pth)
-            f.write(self.erg)
+        pth.parent.mkdir(parents=True,exist_ok=True)
+        print('Saving',pth)
+        atomic_write(pth,self.write_erg if erg is None else erg)
 
     @classmethod
-    def excel(cls,collection,sheet)->list[Course]:
-        ret = []       
-        ranges = sheet.implicit_named_ranges()
+    def _excel_sections(cls,sheet)->tuple[dict,dict]:
+        #header and link sections, plus whatever ranges are left over for the course data
+        ranges = dict(sheet.implicit_named_ranges())
         missing:list[str] = []
-        collection_kwargs:dict[str,ls.Header|cls.PrependedCourse|cls.AppendedCourse] = {}
-        course_data:dict[str,list[cls.CourseSegment]] = {}
+        collection_kwargs:dict[str,cls.Header|cls.PrependedCourse|cls.AppendedCourse] = {}
 
         for req_section in (cls.Header,cls.PrependedCourse,cls.AppendedCourse,):
-            try:
-                for row in range(100):
-                    req_section_range = ranges.pop((req_section.template_name,row),None)
-                    if req_section_range:
-                        break
-                else:
-                    raise KeyError(req_section.template_name)
-            except KeyError as ke:
+            range_keys = [k for k in sheet.implicit_named_range_keys(req_section.template_name) if k[1]<100]
+            if not range_keys:
                 missing.append(req_section.template_name)
             else:
+                req_section_range = ranges.pop(range_keys[0])
                 keys = list(req_section.classkey.keys())
                 section_data = req_section_range.list(element=dict,
                                                           element_keys=keys)
@@ -544,9 +1225,11 @@ class Course:
                     collection_kwargs[req_section.key_word_argument] = [req_section.parse(**line) for line in section_data]
         if missing:
             raise Exception(f"Couldn't find data for {', '.join(missing)} in top row on sheet '{sheet.title}'.")
+        return collection_kwargs,ranges
 
-        header = collection_kwargs['header']
-
+    @staticmethod
+    def _excel_course_ranges(header:Header,ranges:dict)->dict[str,Any]:
+        ret = {}
         course_ranges = list(ranges.values())
         for course_range in course_ranges:
             if course_range.name.startswith('Course'):
@@ -556,16 +1239,36 @@ class Course:
                 
                 name = header.name + suffix
                 r = 1
-                while name in course_data:
+                while name in ret:
                     if len(name_array := name.split(' '))>1:                    
                         name = f"{' '.join(name_array[:-1])} V{r}"
                     else:
                         name = f"{' '.join(name_array)} V{r}"
                     r+=1
+                ret[name] = course_range
+        return ret
+
+    @classmethod
+    def excel_index(cls,sheet)->dict[str,Category]:
+        #version names on a sheet without reading any segment rows
+        collection_kwargs,ranges = cls._excel_sections(sheet)
+        header = collection_kwargs['header']
+        versions = cls._parse_versions(header.versions)
+        return {cls._version_name(name,version,len(versions)>1):header.category \
+            for name in cls._excel_course_ranges(header,ranges) for version in versions}
 
-                course_data[name] = [cls.CourseSegment.parse(**line) for line in \
-                    course_range.list(element=dict,
-                                      element_keys=list(cls.CourseSegment.classkey.keys()))]
+    @classmethod
+    def excel(cls,collection,sheet)->list[Course]:
+        ret = []       
+        collection_kwargs,ranges = cls._excel_sections(sheet)
+        header = collection_kwargs['header']
+        course_data:dict[str,SegmentTable] = {}
+
+        for name,course_range in cls._excel_course_ranges(header,ranges).items():
+            #validated rows become one table that every version of the course shares
+            course_data[name] = SegmentTable.from_segments([cls.CourseSegment.parse(**line) for line in \
+                course_range.list(element=dict,
+                                  element_keys=list(cls.CourseSegment.classkey.keys()))])
 
         for course_name,course_segments in course_data.items():
             versions = cls._parse_versions(header.versions)
@@ -579,6 +1282,75 @@ class Course:
 
         return ret
 
+    @classmethod
+    def text(cls,collection:CourseCollection,sheet:TextSheet)->list[Course]:
+        #same courses Course.excel would make from a sheet holding these rows
+        header = cls.Header(**({'name':sheet.title} | _text_fields(cls.Header,sheet.fields)))
+        prepend = [cls.PrependedCourse(**link) for link in sheet.before]
+        append = [cls.AppendedCourse(**link) for link in sheet.after]
+        versions = cls._parse_versions(header.versions)
+        ret = []
+        for suffix,rows in sheet.courses.items():
+            table = SegmentTable.from_rows(rows)
+            for version in versions:
+                ret.append(cls(collection,
+                               header=header,
+                               name=f"{header.name} {suffix}" if suffix else header.name,
+                               version=version,
+                               course_data=table,
+                               versioned=len(versions)>1,
+                               prepend=prepend,
+                               append=append))
+        return ret
+
+    @classmethod
+    def text_sheet(cls,sheet)->TextSheet:
+        #an excel sheet as a text section
+        collection_kwargs,ranges = cls._excel_sections(sheet)
+        header = collection_kwargs['header']
+        text = TextSheet(title=header.name,line=0,fields={'category':header.category.value})
+        if header.versions is not None:
+            text.fields['repeat'] = str(header.versions)
+        if header.comments:
+            text.fields['comments'] = ' '.join(header.comments.split())
+        for key,links in (('before','prepend'),('after','append')):
+            getattr(text,key).extend({'name':link.name,'blend':link.blend} for link in collection_kwargs[links] or [])
+        for name,course_range in cls._excel_course_ranges(header,ranges).items():
+            rows = [cls.CourseSegment.parse(**line) for line in \
+                course_range.list(element=dict,element_keys=list(cls.CourseSegment.classkey.keys()))]
+            text.courses[name[len(header.name):].strip()] = \
+                [(row.time,row.power_start,row.ramp_to,bool(row.exclude)) for row in rows]
+        return text
+
+    def snapshot(self)->dict:
+        #what CourseCollection.write_snapshot keeps besides the segments
+        return {'name':self.name,'category':self.category.value,'comments':self.comments,
+                'version':self.version,'versioned':self.versioned,
+                'prepend':[link.dict() for link in self._prepend_names or []],
+                'append':[link.dict() for link in self._append_names or []]}
+
+    @classmethod
+    def from_snapshot(cls,collection:CourseCollection,entry:dict,segments:SegmentTable)->Course:
+        #the segments were saved linked and with every repeat written out
+        header = cls.Header(name=entry['name'],category=entry['category'],comments=entry['comments'])
+        course = cls(collection,header,name=entry['name'],version=entry['version'],versioned=entry['versioned'],
+                     prepend=[cls.PrependedCourse(**link) for link in entry['prepend']] or None,
+                     append=[cls.AppendedCourse(**link) for link in entry['append']] or None)
+        course._block = TableBlock(segments)
+        course.linked = True
+        return course
+
+    @classmethod
+    def from_file(cls,collection:CourseCollection,course_file:CourseFile)->Course:
+        #the erg already has every repeat written out, so the segments are taken as they are for any version
+        name,version,versioned = course_file.base_name
+        header = cls.Header(name=name,category=_file_category(course_file))
+        course = cls(collection,header,name=name,version=1,versioned=False)
+        course.version,course.versioned = version,versioned
+        course._block = TableBlock(course_file.table(collection.ftp))
+        course.linked = True
+        return course
+
     @classmethod
     def _parse_versions(cls,ver:str|float|None)->list[str]:
         if isinstance(ver,str):
@@ -0,0 +1,231 @@
+from __future__ import annotations
+import re
+from dataclasses import dataclass,field
+from pathlib import Path
+from typing import Optional,Iterable,IO
+
+#a collection as plain text, one [section] per sheet, Config and Riders are the same as the xlsx sheets
+#
+#   [Config]
+#   ftp = 360
+#   zones = 55,75,90,105,120,150
+#
+#   [Riders]
+#   Alice = 250
+#   Bob = 310, zones 55,75,90,105,120,150
+#
+#   [Cadiz]
+#   category = Aerobic Base
+#   repeat = 6-11
+#   before = Easy Warmup, blend 30
+#   after = Easy Cooldown
+#   10' @ 200W
+#   4x(3'30" @ 250W -> 300W, 1' @ 180W)
+#   2' @ 180W exclude
+#
+#'course <suffix>' starts another course on the same sheet, i.e. 'course V2' is 'Cadiz V2', a line starting
+#with '#' is ignored and a repeat group can run over several lines until its bracket is closed
+
+TEXT_SUFFIX = '.courses'
+RESERVED_SECTIONS = ('config','riders')
+_NUMBER = r'\d+(?:\.\d*)?|\.\d+'
+_SECTION_RE = re.compile(r'^\[(.+)\]$')
+_REPEAT_RE = re.compile(r'^(\d+)\s*x\s*\((.*)\)$',re.IGNORECASE|re.DOTALL)
+_TIME_RE = re.compile(rf"^(?:(?P<minutes>{_NUMBER})')?\s*(?:(?P<seconds>{_NUMBER})\")?$")
+_SEGMENT_RE = re.compile(rf"^(?P<time>[^@]+?)\s*@\s*(?P<power>{_NUMBER})\s*W?"
+                         rf"(?:\s*->\s*(?P<ramp_to>{_NUMBER})\s*W?)?(?P<exclude>\s+exclude)?$",re.IGNORECASE)
+_BLEND_RE = re.compile(r'^(?P<name>.*?)\s*,\s*blend\s+(?P<blend>\d+)\s*s?$',re.IGNORECASE)
+_RIDER_RE = re.compile(rf'^(?:(?P<name>[^=]+?)\s*=\s*)?(?P<ftp>{_NUMBER})(?:\s*,\s*zones\s+(?P<zones>.+))?$',re.IGNORECASE)
+
+#time in minutes, power, ramp-to power, exclude from last repeat, i.e. one row of a Course range
+Row = tuple[float,float,Optional[float],bool]
+
+@dataclass
+class TextSheet:
+    title:str
+    line:int
+    fields:dict[str,str] = field(default_factory=dict)
+    before:list[dict] = field(default_factory=list)
+    after:list[dict] = field(default_factory=list)
+    #keyed by the suffix after the header name, '' for the sheet's own course
+    courses:dict[str,list[Row]] = field(default_factory=dict)
+
+@dataclass
+class TextCollection:
+    config:dict[str,str] = field(default_factory=dict)
+    riders:list[dict] = field(default_factory=list)
+    sheets:list[TextSheet] = field(default_factory=list)
+
+def parse_time(text:str)->float:
+    #10' 30" 3'30" or bare minutes
+    text = text.strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    match = _TIME_RE.match(text)
+    if not text or not match:
+        raise ValueError(f"'{text}' isn't a time, expected something like 3'30\" or 3.5")
+    return float(match.group('minutes') or 0)+float(match.group('seconds') or 0)/60
+
+def parse_segment(text:str)->Row:
+    match = _SEGMENT_RE.match(text.strip())
+    if not match:
+        raise ValueError(f"'{text.strip()}' isn't a segment, expected something like 3' @ 250W -> 300W")
+    ramp_to = match.group('ramp_to')
+    return (parse_time(match.group('time')),float(match.group('power')),
+            float(ramp_to) if ramp_to is not None else None,bool(match.group('exclude')))
+
+def _split(text:str)->list[str]:
+    #commas outside brackets separate items
+    items,depth,start = [],0,0
+    for i,c in enumerate(text):
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == ',' and not depth:
+            items.append(text[start:i])
+            start = i+1
+    items.append(text[start:])
+    return [item.strip() for item in items if item.strip()]
+
+def parse_items(text:str)->list[Row]:
+    #segments and Nx(...) groups, groups nest
+    rows = []
+    for item in _split(text):
+        match = _REPEAT_RE.match(item)
+        if match:
+            rows.extend(parse_items(match.group(2))*int(match.group(1)))
+        else:
+            rows.append(parse_segment(item))
+    return rows
+
+def _link(text:str)->dict:
+    match = _BLEND_RE.match(text)
+    if match:
+        return {'name':match.group('name'),'blend':int(match.group('blend'))}
+    return {'name':text.strip(),'blend':None}
+
+def _rider(text:str)->dict:
+    match = _RIDER_RE.match(text)
+    if not match:
+        raise ValueError(f"'{text}' isn't a rider, expected something like 'Alice = 250'")
+    return {k:v for (k,v) in match.groupdict().items() if v is not None}
+
+def read_text(stream:Iterable[str],name:str='<text>')->TextCollection:
+    collection = TextCollection()
+    section:Optional[str] = None
+    sheet:Optional[TextSheet] = None
+    course:Optional[list[Row]] = None
+    pending:list[str] = []
+    depth = 0
+    for line_no,line in enumerate(stream,1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            if pending:
+                #still inside an open repeat group
+                pending.append(line)
+                depth += line.count('(')-line.count(')')
+                if depth <= 0:
+                    course.extend(parse_items(','.join(pending)))
+                    pending = []
+                continue
+            if match := _SECTION_RE.match(line):
+                section = match.group(1).strip()
+                sheet = course = None
+                if section.lower() not in RESERVED_SECTIONS:
+                    sheet = TextSheet(title=section,line=line_no)
+                    collection.sheets.append(sheet)
+                continue
+            if section is None:
+                raise ValueError(f"'{line}' comes before the first [section]")
+            key,eq,value = line.partition('=')
+            key = key.strip().lower()
+            #segment lines never have an '=', everything else on a sheet is 'key = value' or a course marker
+            if section.lower() == 'config':
+                if not eq:
+                    raise ValueError(f"expected 'key = value', not '{line}'")
+                collection.config[key] = value.strip()
+            elif section.lower() == 'riders':
+                collection.riders.append(_rider(line))
+            elif eq:
+                if key in ('before','after'):
+                    getattr(sheet,key).append(_link(value.strip()))
+                elif key in sheet.fields:
+                    raise ValueError(f"'{key}' is set twice")
+                else:
+                    sheet.fields[key] = value.strip()
+            elif key == 'course' or key.startswith('course '):
+                suffix = line[len('course'):].strip()
+                if suffix in sheet.courses:
+                    raise ValueError(f"'course {suffix}' is already on this sheet")
+                course = sheet.courses[suffix] = []
+            else:
+                if course is None:
+                    course = sheet.courses.setdefault('',[])
+                depth = line.count('(')-line.count(')')
+                if depth > 0:
+                    pending = [line]
+                else:
+                    course.extend(parse_items(line))
+        except ValueError as e:
+            raise Exception(f"{name}:{line_no}: {e}")
+    if pending:
+        raise Exception(f"{name}: repeat group '{pending[0]}' is never closed")
+    return collection
+
+def read_text_file(pth:Path|str)->TextCollection:
+    pth = Path(pth)
+    with open(pth,'r',buffering=1<<16) as f:
+        return read_text(f,pth.name)
+
+def format_number(value:float)->str:
+    return f"{value:.12g}"
+
+def format_time(minutes:float)->str:
+    #whole seconds as 3'30", anything finer stays in minutes so it reads back exactly
+    seconds = minutes*60
+    if abs(seconds-round(seconds)) > 1e-9 or seconds <= 0:
+        return format_number(minutes)
+    whole,rest = divmod(int(round(seconds)),60)
+    return (f"{whole}'" if whole else '')+(f'{rest}"' if rest else '')
+
+def format_row(row:Row)->str:
+    time,power,ramp_to,exclude = row
+    parts = [f"{format_time(time)} @ {format_number(power)}W"]
+    if ramp_to:
+        parts.append(f" -> {format_number(ramp_to)}W")
+    if exclude:
+        parts.append(" exclude")
+    return ''.join(parts)
+
+def format_link(link:dict)->str:
+    if link.get('blend'):
+        return f"{link['name']}, blend {link['blend']}"
+    return link['name']
+
+def write_text(stream:IO[str],collection:TextCollection)->None:
+    stream.write('[Config]\n')
+    for key,value in collection.config.items():
+        stream.write(f"{key} = {value}\n")
+    if collection.riders:
+        stream.write('\n[Riders]\n')
+        for rider in collection.riders:
+            line = f"{rider['name']} = {rider['ftp']}" if rider.get('name') else f"{rider['ftp']}"
+            if rider.get('zones'):
+                line += f", zones {rider['zones']}"
+            stream.write(line+'\n')
+    for sheet in collection.sheets:
+        stream.write(f"\n[{sheet.title}]\n")
+        for key,value in sheet.fields.items():
+            stream.write(f"{key} = {value}\n")
+        for key in ('before','after'):
+            for link in getattr(sheet,key):
+                stream.write(f"{key} = {format_link(link)}\n")
+        for suffix,rows in sheet.courses.items():
+            if suffix or len(sheet.courses) > 1:
+                stream.write(f"course {suffix}".rstrip()+'\n')
+            stream.writelines(format_row(row)+'\n' for row in rows)
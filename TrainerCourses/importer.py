@@ -0,0 +1,130 @@
+from __future__ import annotations
+import re
+import numpy as np
+from pathlib import Path
+from dataclasses import dataclass,field
+from typing import Optional,Iterable,IO
+from .segments import SegmentTable
+
+COURSE_SUFFIXES = ('.erg','.mrc')
+_VERSION_RE = re.compile(r'^(?P<name>.*)-(?P<version>\d+)x$')
+
+@dataclass
+class CourseFile:
+    #one .erg/.mrc as written by Course.write_erg (or any tool using the same layout), points are (minutes,value) rows
+    name:str
+    header:dict[str,str] = field(default_factory=dict)
+    percent:bool = False
+    points:np.ndarray = field(default_factory=lambda:np.zeros((0,2)))
+    path:Optional[Path] = None
+
+    @property
+    def ftp(self)->Optional[float]:
+        if 'FTP' in self.header:
+            return float(self.header['FTP'])
+
+    @property
+    def description(self)->str:
+        return self.header.get('DESCRIPTION','')
+
+    @property
+    def base_name(self)->tuple[str,int,bool]:
+        #'Cadiz-6x' written from 'Cadiz.erg' is version 6 of Cadiz, anything else is a course of its own
+        file_name = Path(self.header.get('FILE NAME','')).stem
+        match = _VERSION_RE.match(self.name)
+        if match and file_name and match.group('name') == file_name:
+            return file_name,int(match.group('version')),True
+        return self.name,1,False
+
+    def table(self,ftp:Optional[float]=None)->SegmentTable:
+        points = self.points
+        if self.percent:
+            if not ftp:
+                raise Exception(f"'{self.name}' is in percent of ftp, an ftp is needed to read it")
+            points = points*[1.0,ftp/100]
+        return points_to_table(points)
+
+def points_to_table(points:np.ndarray)->SegmentTable:
+    #every pair of points that moves forward in time is a segment, a pair sharing a time is the jump between two
+    #segments so the duplicated boundary points an erg is written with fall away and ramps come back as ramps
+    points = np.asarray(points,dtype=np.float64).reshape(-1,2)
+    if len(points) < 2:
+        return SegmentTable([],[],[],[],[])
+    time,power = points[:,0],points[:,1]
+    #times are written to a tenth of a minute, keep the float noise of the subtraction out of the segment lengths
+    step = np.round(np.diff(time),6)
+    keep = step > 0
+    start,end = power[:-1][keep],power[1:][keep]
+    return SegmentTable(step[keep],start,end,start != end,np.zeros(int(keep.sum()),dtype=bool))
+
+def read_course(stream:IO[str],name:str,chunk:int=4096)->CourseFile:
+    #header lines are 'KEY = value' plus the units line, data lines are read 'chunk' at a time into one array
+    course = CourseFile(name=name)
+    section = None
+    rows:list[np.ndarray] = []
+    pending:list[str] = []
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('['):
+            tag = line.upper()
+            if tag == '[COURSE HEADER]':
+                section = 'header'
+            elif tag == '[COURSE DATA]':
+                section = 'data'
+            else:
+                section = None
+            continue
+        if section == 'data':
+            pending.append(line)
+            if len(pending) >= chunk:
+                rows.append(_parse_points(pending,name))
+                pending = []
+        elif section == 'header':
+            if '=' in line:
+                key,_,value = line.partition('=')
+                course.header[key.strip().upper()] = value.strip()
+            elif line.upper().split()[-1:] == ['PERCENT']:
+                course.percent = True
+    if pending:
+        rows.append(_parse_points(pending,name))
+    if rows:
+        course.points = np.concatenate(rows)
+    return course
+
+def _parse_points(lines:list[str],name:str)->np.ndarray:
+    values = ' '.join(lines).split()
+    try:
+        return np.array(values,dtype=np.float64).reshape(-1,2)
+    except ValueError:
+        raise Exception(f"'{name}' has course data that isn't 'minutes value' pairs")
+
+def read_course_file(pth:Path|str)->CourseFile:
+    pth = Path(pth)
+    with open(pth,'r',buffering=1<<16) as f:
+        course = read_course(f,pth.stem)
+    course.path = pth
+    return course
+
+def find_course_files(src:Path|str|Iterable[Path|str])->list[Path]:
+    #a file, a directory tree, or a mix of both, in a stable order
+    if isinstance(src,(str,Path)):
+        src = [src]
+    found = []
+    for pth in map(Path,src):
+        if pth.is_dir():
+            found.extend(sorted(p for p in pth.rglob('*') if p.suffix.lower() in COURSE_SUFFIXES and p.is_file()))
+        elif pth.suffix.lower() in COURSE_SUFFIXES:
+            found.append(pth)
+    return found
+
+def read_course_files(paths:list[Path])->list[CourseFile|str]:
+    #runs in a worker, a file that can't be read comes back as the reason instead of sinking the batch
+    ret = []
+    for pth in paths:
+        try:
+            ret.append(read_course_file(pth))
+        except Exception as e:
+            ret.append(f"{pth}: {e}")
+    return ret
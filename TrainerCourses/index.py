@@ -0,0 +1,148 @@
+from __future__ import annotations
+import re
+from bisect import bisect_left
+from typing import Optional,Any,Callable,Iterable
+import numpy as np
+
+_AND_RE = re.compile(r'\s+and\s+',re.IGNORECASE)
+_CLAUSE_RE = re.compile(r'^\s*([A-Za-z_][\w ]*?)\s*(>=|<=|!=|==|=|>|<)\s*(.*?)\s*$')
+
+class _PrefixIndex:
+    #sorted keys and the course each came from, everything starting with a prefix is one bisect range
+    def __init__(self,keys:Iterable[tuple[str,int]])->None:
+        pairs = sorted(keys)
+        self.keys = [key for (key,position) in pairs]
+        self.positions = np.array([position for (key,position) in pairs],dtype=np.int64)
+
+    def prefix(self,prefix:str)->np.ndarray:
+        lo = bisect_left(self.keys,prefix)
+        hi = bisect_left(self.keys,prefix+'\U0010ffff',lo)
+        return self.positions[lo:hi]
+
+class _RangeIndex:
+    #one stats field sorted once, comparisons are a searchsorted away
+    def __init__(self,values:Iterable[float])->None:
+        values = np.asarray(list(values),dtype=np.float64)
+        self.order = np.argsort(values,kind='stable')
+        self.values = values[self.order]
+
+    def select(self,op:str,value:float)->np.ndarray:
+        lo = np.searchsorted(self.values,value,side='left')
+        hi = np.searchsorted(self.values,value,side='right')
+        if op in ('=','=='):
+            hits = self.order[lo:hi]
+        elif op == '!=':
+            hits = np.concatenate((self.order[:lo],self.order[hi:]))
+        elif op == '>':
+            hits = self.order[hi:]
+        elif op == '>=':
+            hits = self.order[lo:]
+        elif op == '<':
+            hits = self.order[:lo]
+        else:
+            hits = self.order[:hi]
+        return hits
+
+class CourseIndex:
+    #name globs go through sorted name, reversed name and suffix indexes, category is a lookup and the stats
+    #fields are range indexes built the first time they're asked for, courses come back in collection order
+    FIELDS:dict[str,str] = {'time':'time','average':'average','np':'np','if':'ftpif','ftpif':'ftpif',
+                            'tss':'tss','kj':'kj','vi':'vi'}
+
+    def __init__(self,names:list[str],categories:list[str],stats:Callable[[],list[Any]])->None:
+        self.names = list(names)
+        self._stats = stats
+        lowered = [name.lower() for name in self.names]
+        self._exact:dict[str,list[int]] = {}
+        for position,name in enumerate(lowered):
+            self._exact.setdefault(name,[]).append(position)
+        self._prefix = _PrefixIndex((name,position) for (position,name) in enumerate(lowered))
+        self._suffix = _PrefixIndex((name[::-1],position) for (position,name) in enumerate(lowered))
+        self._substring:Optional[_PrefixIndex] = None
+        self._category:dict[str,list[int]] = {}
+        for position,category in enumerate(categories):
+            self._category.setdefault(category.lower(),[]).append(position)
+        self._ranges:dict[str,_RangeIndex] = {}
+
+    def __len__(self)->int:
+        return len(self.names)
+
+    def _mask(self,positions:Iterable[int]|np.ndarray|slice)->np.ndarray:
+        #every lookup ends up as a boolean mask over the courses so clauses combine with & and |
+        mask = np.zeros(len(self.names),dtype=bool)
+        mask[positions] = True
+        return mask
+
+    @property
+    def substring(self)->_PrefixIndex:
+        #every suffix of every name, a substring is a prefix of one of them, only built for the first '*x*' glob
+        if self._substring is None:
+            self._substring = _PrefixIndex((name[start:],position) for (position,name) in \
+                                           enumerate(name.lower() for name in self.names) for start in range(len(name)))
+        return self._substring
+
+    def glob(self,pattern:str)->np.ndarray:
+        #same patterns as qkfltr, '*name*', '*name', 'name*' or an exact name, case insensitive
+        pattern = pattern.lower()
+        if len(pattern) > 1 and pattern.startswith('*') and pattern.endswith('*'):
+            if not pattern[1:-1]:
+                return self._mask(slice(None))
+            return self._mask(self.substring.prefix(pattern[1:-1]))
+        elif pattern == '*':
+            return self._mask(slice(None))
+        elif pattern.startswith('*'):
+            return self._mask(self._suffix.prefix(pattern[1:][::-1]))
+        elif pattern.endswith('*'):
+            return self._mask(self._prefix.prefix(pattern[:-1]))
+        return self._mask(self._exact.get(pattern,[]))
+
+    def category(self,category:str)->np.ndarray:
+        return self._mask(self._category.get(category.strip().lower(),[]))
+
+    def _range(self,field:str)->_RangeIndex:
+        if field not in self._ranges:
+            self._ranges[field] = _RangeIndex(getattr(stats,field) for stats in self._stats())
+        return self._ranges[field]
+
+    def clause(self,clause:str)->np.ndarray:
+        match = _CLAUSE_RE.match(clause)
+        if not match:
+            raise Exception(f"Can't read '{clause}', expected something like 'tss>80' or 'category=Sweet Spot'")
+        field,op,value = match.group(1).strip().lower(),match.group(2),match.group(3)
+        if field in ('name','category'):
+            if op not in ('=','==','!='):
+                raise Exception(f"'{field}' can only be compared with = or !=")
+            #'|' separates alternatives, i.e. category=Sweet Spot|Anaerobic
+            lookup = self.glob if field == 'name' else self.category
+            hits = np.logical_or.reduce([lookup(alternative.strip()) for alternative in value.split('|')])
+            return ~hits if op == '!=' else hits
+        if field not in self.FIELDS:
+            raise Exception(f"Unknown field '{field}', expected name, category or one of {', '.join(self.FIELDS)}")
+        try:
+            number = float(value)
+        except ValueError:
+            raise Exception(f"'{field}' needs a number, not '{value}'")
+        return self._mask(self._range(self.FIELDS[field]).select(op,number))
+
+    def query(self,where:str)->np.ndarray:
+        #clauses joined with 'and'
+        hits = self._mask(slice(None))
+        for clause in _AND_RE.split(where.strip()):
+            hits &= self.clause(clause)
+            if not hits.any():
+                break
+        return hits
+
+    def select(self,include:Optional[list[str]|str]=None,
+               exclude:Optional[list[str]|str]=None,
+               where:Optional[str]=None)->list[str]:
+        hits = self._mask(slice(None))
+        if include:
+            include = [include] if isinstance(include,str) else include
+            hits = np.logical_or.reduce([self.glob(pattern) for pattern in include])
+        if exclude:
+            exclude = [exclude] if isinstance(exclude,str) else exclude
+            hits &= ~np.logical_or.reduce([self.glob(pattern) for pattern in exclude])
+        if where and hits.any():
+            hits &= self.query(where)
+        return [self.names[position] for position in np.flatnonzero(hits).tolist()]
@@ -0,0 +1,214 @@
+from __future__ import annotations
+import numpy as np
+from abc import ABC,abstractmethod
+from typing import Iterable,Any
+from .segments import SegmentTable
+from .timeline import power_timelines,PiecewiseTimeline
+
+#upper bounds of coggan zones 1-6 as a fraction of ftp, zone 7 is everything above
+COGGAN_ZONES = (0.55,0.75,0.90,1.05,1.20,1.50)
+
+class Sweep:
+    #shared state for one pass over back to back timelines, metrics read from here instead of rescanning
+    def __init__(self,pbs:np.ndarray,lengths:np.ndarray)->None:
+        self.pbs = np.asarray(pbs,dtype=np.float64)
+        self.lengths = np.asarray(lengths,dtype=np.int64)
+        self.count = len(self.lengths)
+        self.starts = np.cumsum(self.lengths)-self.lengths
+        nonempty = np.flatnonzero(self.lengths>0)
+        self.average = np.zeros(self.count)
+        if len(nonempty):
+            self.average[nonempty] = self.reduce(np.add,self.pbs,nonempty)/self.lengths[nonempty]
+        #centre each course on its own mean so the running total returns to ~0 at every course boundary
+        self.offset = np.repeat(self.average,self.lengths)
+        self.csum = np.empty(len(self.pbs)+1)
+        self.csum[0] = 0.0
+        np.cumsum(self.pbs-self.offset,out=self.csum[1:])
+        self._sums = {}
+        self._owner = None
+
+    @property
+    def owner(self)->np.ndarray:
+        #course index of every second
+        if self._owner is None:
+            self._owner = np.repeat(np.arange(self.count),self.lengths)
+        return self._owner
+
+    def reduce(self,ufunc:np.ufunc,values:np.ndarray,courses:np.ndarray,trim:int=0)->np.ndarray:
+        #ufunc over each course's values, dropping the last 'trim' which belong to windows running off the end
+        starts = self.starts[courses]
+        bounds = np.stack((starts,starts+self.lengths[courses]-trim),axis=1).ravel()
+        if len(bounds) and bounds[-1] >= len(values):
+            bounds = bounds[:-1]
+        return ufunc.reduceat(values,bounds)[::2]
+
+    def fits(self,seconds:int)->np.ndarray:
+        #courses at least this long
+        if seconds <= 0:
+            return np.zeros(0,dtype=np.int64)
+        return np.flatnonzero(self.lengths>=seconds)
+
+    def window_sums(self,seconds:int)->np.ndarray:
+        #centred sum of the 'seconds' starting at each second, shared by every metric asking for that window
+        if seconds not in self._sums:
+            self._sums[seconds] = np.subtract(self.csum[seconds:],self.csum[:-seconds])
+        return self._sums[seconds]
+
+class Metric(ABC):
+    #a CourseStats field, per course values for a whole sweep or one closed form timeline, a metric only
+    #has to support the mode it is used with
+    @property
+    @abstractmethod
+    def name(self)->str:
+        ...
+
+    def sweep(self,sweep:Sweep,results:dict[str,np.ndarray])->np.ndarray:
+        raise Exception(f"{type(self).__name__} ('{self.name}') has no sweep mode, compute stats with analytic_stats=True")
+
+    def analytic(self,timeline:PiecewiseTimeline,results:dict[str,Any])->Any:
+        raise Exception(f"{type(self).__name__} ('{self.name}') has no analytic mode, compute stats with analytic_stats=False")
+
+class AveragePower(Metric):
+    name = 'average'
+
+    def sweep(self,sweep:Sweep,results:dict[str,np.ndarray])->np.ndarray:
+        return sweep.average
+
+    def analytic(self,timeline:PiecewiseTimeline,results:dict[str,Any])->float:
+        return timeline.average()
+
+class NormalizedPower(Metric):
+    name = 'np'
+
+    def __init__(self,window:int=30)->None:
+        self.window = max(1,int(window))
+
+    def sweep(self,sweep:Sweep,results:dict[str,np.ndarray])->np.ndarray:
+        #courses shorter than the window roll over their whole length, i.e. np is the average
+        normalized = sweep.average.copy()
+        full = sweep.fits(self.window)
+        if len(full):
+            rolling = sweep.window_sums(self.window)/self.window
+            rolling += sweep.offset[:len(rolling)]
+            rolling *= rolling
+            rolling *= rolling
+            fourth = sweep.reduce(np.add,rolling,full,self.window-1)
+            normalized[full] = (fourth/(sweep.lengths[full]-self.window+1))**(1/4)
+        return normalized
+
+    def analytic(self,timeline:PiecewiseTimeline,results:dict[str,Any])->float:
+        return timeline.normalized_power(self.window)
+
+class PowerAverages(Metric):
+    name = 'power_averages'
+
+    def __init__(self,durations:Iterable[int])->None:
+        self.durations = [int(d) for d in durations]
+
+    def sweep(self,sweep:Sweep,results:dict[str,np.ndarray])->np.ndarray:
+        #mean-maximal power, nan where the course is shorter than the duration
+        curve = np.full((sweep.count,len(self.durations)),np.nan)
+        for c,d in enumerate(self.durations):
+            fits = sweep.fits(d)
+            if not len(fits):
+                continue
+            sums = sweep.window_sums(d)
+            best = sweep.reduce(np.maximum,sums,fits,d-1)/d+sweep.average[fits]
+            #prefix sums are good to ~1e-9, only averages sitting on a whole watt need the winning window re-summed
+            #so the int() the stats take can't land on the wrong side
+            for i in np.flatnonzero(np.abs(best-np.rint(best)) < 1e-6):
+                start = sweep.starts[fits[i]]
+                start += int(np.argmax(sums[start:start+sweep.lengths[fits[i]]-d+1]))
+                best[i] = sweep.pbs[start:start+d].mean()
+            curve[fits,c] = best
+        return curve
+
+    def analytic(self,timeline:PiecewiseTimeline,results:dict[str,Any])->np.ndarray:
+        return timeline.power_curve(self.durations)
+
+class Work(Metric):
+    name = 'kj'
+
+    def sweep(self,sweep:Sweep,results:dict[str,np.ndarray])->np.ndarray:
+        return sweep.average*sweep.lengths/1000
+
+    def analytic(self,timeline:PiecewiseTimeline,results:dict[str,Any])->float:
+        return timeline.work/1000
+
+class VariabilityIndex(Metric):
+    #np over average, needs both to have run first
+    name = 'vi'
+
+    def sweep(self,sweep:Sweep,results:dict[str,np.ndarray])->np.ndarray:
+        average = results['average']
+        return np.divide(results['np'],average,out=np.zeros(len(average)),where=average>0)
+
+    def analytic(self,timeline:PiecewiseTimeline,results:dict[str,Any])->float:
+        if results['average'] > 0:
+            return results['np']/results['average']
+        return 0.0
+
+class TimeInZone(Metric):
+    #seconds in each zone, bounds are fractions of ftp
+    name = 'zones'
+
+    def __init__(self,ftp:float,bounds:Iterable[float]=COGGAN_ZONES)->None:
+        self.ftp = ftp
+        self.bounds = tuple(bounds)
+
+    @property
+    def edges(self)->np.ndarray:
+        return self.ftp*np.asarray(self.bounds,dtype=np.float64)
+
+    def sweep(self,sweep:Sweep,results:dict[str,np.ndarray])->np.ndarray:
+        zones = len(self.bounds)+1
+        #a power right on a bound belongs to the zone below
+        zone = np.searchsorted(self.edges,sweep.pbs,side='left')
+        counts = np.bincount(sweep.owner*zones+zone,minlength=sweep.count*zones)
+        return counts.reshape(sweep.count,zones).astype(np.float64)
+
+    def analytic(self,timeline:PiecewiseTimeline,results:dict[str,Any])->np.ndarray:
+        return timeline.time_in_zones(self.edges)
+
+class MetricPipeline:
+    #metrics run in order over one sweep per chunk of courses, later metrics can use earlier results
+    def __init__(self,metrics:Iterable[Metric],chunk:int=1<<15)->None:
+        self.metrics = list(metrics)
+        self.chunk = chunk
+
+    def __getitem__(self,name:str)->Metric:
+        for metric in self.metrics:
+            if metric.name == name:
+                return metric
+        raise KeyError(name)
+
+    def register(self,metric:Metric)->None:
+        self.metrics.append(metric)
+
+    def sweep(self,pbs:np.ndarray,lengths:np.ndarray)->dict[str,np.ndarray]:
+        sweep = Sweep(pbs,lengths)
+        results = {}
+        for metric in self.metrics:
+            results[metric.name] = metric.sweep(sweep,results)
+        return results
+
+    def run(self,tables:Iterable[SegmentTable])->dict[str,np.ndarray]:
+        #courses are packed 'chunk' seconds at a time, big enough to vectorize, small enough to stay in cache
+        tables = list(tables)
+        seconds = np.cumsum([60*table.end_time for table in tables])
+        parts = []
+        first = 0
+        while first < len(tables):
+            last = max(first+1,int(np.searchsorted(seconds,seconds[first]+self.chunk,side='right')))
+            parts.append(self.sweep(*power_timelines(tables[first:last])))
+            first = last
+        if not parts:
+            parts.append(self.sweep(*power_timelines([])))
+        return {metric.name:np.concatenate([part[metric.name] for part in parts]) for metric in self.metrics}
+
+    def run_analytic(self,table:SegmentTable)->dict[str,Any]:
+        timeline = PiecewiseTimeline(table)
+        results = {}
+        for metric in self.metrics:
+            results[metric.name] = metric.analytic(timeline,results)
+        return results
@@ -1,17 +1,23 @@
 from __future__ import annotations
 import re
+import io
 import openpyxl
 from typing import Optional,Any,Generator,Callable,Iterator,Iterable,NamedTuple
 from pathlib import Path
 from openpyxl.worksheet.worksheet import Worksheet
+from openpyxl.worksheet._reader import WorkSheetParser
+from openpyxl.worksheet.cell_range import MultiCellRange
 from openpyxl import Workbook
 from collections import namedtuple
 from dataclasses import dataclass,field
 from types import MethodType
+import numpy as np
 
 _REPCHAR = ['/','-',' ','\\','&',]
 _REPCHAR_RE = re.compile(r'|'.join([fr"{c}+" for c in _REPCHAR]))
 _SNK_RE = re.compile(r'(?<!^)(?=[A-Z])(\s)')
+_ROW_END_RE = re.compile(rb'</(?:\w+:)?row>|<(?:\w+:)?row\b[^>]*/>')
+_SHEET_DATA_END_RE = re.compile(rb'</(?:\w+:)?sheetData>')
 
 class Printable:
     def __str__(self)->str:
@@ -78,7 +84,10 @@ class ImplicitNamedRange:
         else:
             max_row = min_row + max_row
 
-      
+        if values_only:
+            #sliced from the value matrix the ranges were found in, openpyxl isn't touched again
+            return (tuple(row) for row in \
+                self.sheet._values[min_row-1:max_row,self.min_col-1:self.max_col])
         return self.sheet.iter_rows(min_row=min_row,
                                     max_row=max_row,
                                     max_col=self.max_col,
@@ -139,17 +148,36 @@ class ImplicitNamedRange:
                 ret.append(element(row))
         return ret
 
+def _merged_index(sheet:Worksheet)->dict[int,list[tuple[int,int]]]:
+    #zero based row -> (start,end) columns of each horizontal merge, straight from the sheet metadata
+    by_row = {}
+    for merged in sheet.merged_cells.ranges:
+        if merged.max_col > merged.min_col:
+            by_row.setdefault(merged.min_row-1,[]).append((merged.min_col-1,merged.max_col-1))
+    ret = {}
+    row = 0
+    #named ranges only live in the unbroken run of merged rows at the top of the sheet
+    while row in by_row:
+        ret[row] = sorted(by_row[row])
+        row+=1
+    return ret
+
 def _set_sheet_inrs(sheet:Worksheet)->None:
+    if not sheet._merged_cells:
+        return
     last_merge_row = max(sheet._merged_cells.keys(),default=0)
+    max_col = max(end for col_sets in sheet._merged_cells.values() for (start,end) in col_sets)+1
+    #one read of the block under the merged headers, heights come from where each range's columns go empty
+    if sheet._values is None:
+        sheet._values = np.array(list(sheet.iter_rows(min_row=1,max_row=max(sheet.max_row,last_merge_row+1),
+                                                      max_col=max_col,values_only=True)),dtype=object)
+    values = sheet._values
+    filled = values[:,:max_col].astype(bool)
     for row,col_sets in list(sheet._merged_cells.items()):
         for start,end in col_sets:
-            title = sheet.cell(row=row+1,column=start+1).value
-            height = 0
-            for sub_row in sheet.iter_rows(min_row=row+1,min_col=start+1,max_col=end+1,values_only=True):
-                if any(sub_row):
-                    height+=1
-                else:
-                    break
+            title = values[row,start]
+            occupied = filled[row:,start:end+1].any(axis=1)
+            height = len(occupied) if occupied.all() else int(np.argmin(occupied))
             sr = ImplicitNamedRange(title,max_row=row+height,min_row=row+2,min_col=start+1,max_col=end+1,sheet=sheet)
             if row < last_merge_row:
                 for next_start,next_end in sheet._merged_cells[row+1]:
@@ -158,7 +186,7 @@ def _set_sheet_inrs(sheet:Worksheet)->None:
                     elif next_start>end:
                         break
                     else:
-                        sr._nested.append((sheet.cell(row=row+2,column=next_start+1).value,row+1))
+                        sr._nested.append((values[row+1,next_start],row+1))
             suffix=1
             while (title,row) in sheet._nr:
                 title = title + f'-{suffix}'
@@ -166,12 +194,18 @@ def _set_sheet_inrs(sheet:Worksheet)->None:
                 if suffix>100:
                     raise ValueError((title,row))
             sheet._nr[(title,row)] = sr
+            sheet._nr_names.setdefault(title,[]).append((title,row))
 
 def implicit_named_ranges(sheet:Worksheet)->dict[tuple[str,int],ImplicitNamedRange]:
     if not sheet._nr:
         _set_sheet_inrs(sheet)
     return sheet._nr
 
+def implicit_named_range_keys(sheet:Worksheet,name:str)->list[tuple[str,int]]:
+    #keys of the ranges titled 'name', top row first, without probing row numbers
+    implicit_named_ranges(sheet)
+    return sheet._nr_names.get(name,[])
+
 
  
 def clear_values(self):
@@ -184,6 +218,7 @@ def write_row(self,row:list,offset:tuple[int,int]=(1,1))->None:
         self.cell(row=offset[0],column=offset[1]+column_count).value = value
 
 def write_rows(self,rows:list[list]|list[dict],offset:tuple[int,int]=(1,1))->None:    
+    row_values = rows
     if rows and isinstance(rows[0],dict):
         row_values = [list(rows[0].keys())]
         for row in rows:
@@ -191,6 +226,103 @@ def write_rows(self,rows:list[list]|list[dict],offset:tuple[int,int]=(1,1))->Non
     for row_count,val in enumerate(row_values):
         self.write_row(val,(row_count+offset[0],offset[1]))
 
+class ValueSheet:
+    #a worksheet streamed once into a value matrix, enough for implicit named ranges but not for writing
+    def __init__(self,title:str,values:np.ndarray,merged_cells:MultiCellRange)->None:
+        self.title = title
+        self.merged_cells = merged_cells
+        self._values = values
+        self._nr = {}
+        self._nr_names = {}
+        self._merged_cells = _merged_index(self)
+
+    def __repr__(self)->str:
+        return f'<ValueSheet "{self.title}">'
+
+    @property
+    def max_row(self)->int:
+        return self._values.shape[0]
+
+    @property
+    def max_column(self)->int:
+        return self._values.shape[1]
+
+    def iter_rows(self,min_row:int|None=None,max_row:int|None=None,
+                  min_col:int|None=None,max_col:int|None=None,values_only:bool=True)->Generator:
+        if not values_only:
+            raise TypeError(f"'{self.title}' was opened read only, only values are available")
+        min_row,min_col = min_row or 1,min_col or 1
+        return (tuple(row) for row in self._values[min_row-1:max_row or self.max_row,
+                                                   min_col-1:max_col or self.max_column])
+
+    implicit_named_ranges = implicit_named_ranges
+    implicit_named_range_keys = implicit_named_range_keys
+
+    @classmethod
+    def stream(cls,sheet,head:Optional[int]=None)->ValueSheet:
+        #with 'head' only the first rows are parsed, the rest of the sheet data is cut out of the xml before it
+        #reaches the parser, the merged cells written after it are kept so the range names are all there
+        src = sheet._get_source()
+        try:
+            if head is not None:
+                src = io.BytesIO(_xml_head(src.read(),head))
+            parser = WorkSheetParser(src,sheet._shared_strings,data_only=sheet.parent.data_only,
+                                     epoch=sheet.parent.epoch,date_formats=sheet.parent._date_formats)
+            rows = {idx:cells for (idx,cells) in parser.parse() if cells}
+        finally:
+            src.close()
+        nrows = max(rows,default=0)
+        ncols = max((cell['column'] for cells in rows.values() for cell in cells),default=0)
+        values = np.full((nrows,ncols),None,dtype=object)
+        for idx,cells in rows.items():
+            for cell in cells:
+                values[idx-1,cell['column']-1] = cell['value']
+        merged = MultiCellRange([m.ref for m in parser.merged_cells.mergeCell] if parser.merged_cells else [])
+        return cls(sheet.title,values,merged)
+
+def _xml_head(xml:bytes,rows:int)->bytes:
+    end = 0
+    for _ in range(rows):
+        match = _ROW_END_RE.search(xml,end)
+        if not match:
+            #the whole sheet is shorter than that
+            return xml
+        end = match.end()
+    data_end = _SHEET_DATA_END_RE.search(xml,end)
+    if not data_end:
+        return xml
+    return xml[:end]+xml[data_end.start():]
+
+class ValueWorkbook:
+    def __init__(self,sheets:list[ValueSheet],head:Optional[int]=None)->None:
+        self._sheets = {sheet.title:sheet for sheet in sheets}
+        #sheets other than the 'full' ones hold only their first 'head' rows
+        self.head = head
+
+    @property
+    def sheetnames(self)->list[str]:
+        return list(self._sheets.keys())
+
+    def __getitem__(self,name:str)->ValueSheet:
+        return self._sheets[name]
+
+    def __iter__(self)->Iterator[ValueSheet]:
+        return iter(self._sheets.values())
+
+def open_values(pth:Path|str,sheets:Optional[Iterable[str]]=None,head:Optional[int]=None,
+                full:Iterable[str]=())->ValueWorkbook:
+    #read only, every sheet (or just the ones asked for that exist) is streamed once and the openpyxl workbook is closed again,
+    #with 'head' only the top rows of each sheet not named in 'full' are read
+    wb = openpyxl.load_workbook(Path(pth),read_only=True)
+    full = set(full)
+    try:
+        if sheets is None:
+            sheets = wb.sheetnames
+        return ValueWorkbook([ValueSheet.stream(wb[name],None if name in full else head) \
+                              for name in sheets if name in wb.sheetnames],head)
+    finally:
+        wb.close()
+
 def open(pth:Path|str)->list[Course]:
     def _blanks(v:str|float|int):
         if v == "":
@@ -200,31 +332,16 @@ def open(pth:Path|str)->list[Course]:
     if pth.exists():
         wb = openpyxl.open(pth)
         for sc,sheet in enumerate(wb):
-            sheet._merged_cells = {}
             sheet._nr = {}
+            sheet._nr_names = {}
+            sheet._values = None
             sheet.write_row = MethodType(write_row,sheet)
             sheet.write_rows = MethodType(write_rows,sheet)
             sheet.clear_values = MethodType(clear_values,sheet)
             if not sc:
                 type(sheet).implicit_named_ranges = implicit_named_ranges
-            
-            for rc,row in enumerate(sheet.iter_rows()):
-                row_keys = []
-                key = []
-                if any(isinstance(cell, openpyxl.cell.cell.MergedCell) for cell in row):
-                    for cc,cell in enumerate(row):
-                        if not isinstance(cell,openpyxl.cell.cell.MergedCell):
-                            if len(key)>1:
-                                row_keys.append(tuple([key[0],key[-1]]))
-                            key = [cc]                           
-                        else:
-                            key.append(cc)
-                    if len(key)>1:
-                        row_keys.append(tuple([key[0],key[-1]]))
-                    sheet._merged_cells[rc] = list(row_keys)
-                else:                
-                    break
-       
+                type(sheet).implicit_named_range_keys = implicit_named_range_keys
+            sheet._merged_cells = _merged_index(sheet)
 
         return wb
             
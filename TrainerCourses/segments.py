@@ -0,0 +1,315 @@
+from __future__ import annotations
+import numpy as np
+from abc import ABC,abstractmethod
+from typing import Iterable,Iterator
+
+class SegmentFormat:
+    #display helpers shared by the excel row model and the table views, both expose time/power_start/ramp_to/start_time
+    __slots__ = ()
+
+    @property
+    def end_time(self)->float:
+        return self.start_time+self.time
+
+    @property
+    def power_end(self)->int:
+        if self.ramp_to:
+            return self.ramp_to
+        return self.power_start
+
+    @staticmethod
+    def _erg_fmt(i:float|int)->int|float:
+        if i % 1 == 0:
+            return int(i)
+        else:
+            return round(i,1)
+
+    @property
+    def power(self):
+        if self.power_end:
+            return (self.power_start+self.power_end)/2
+        return self.power_start
+
+    @property
+    def erg(self)->str:
+        return f"{self._erg_fmt(self.start_time)}\t{int(self.power_start)}\n"+\
+            f"{self._erg_fmt(self.start_time+self.time)}\t{int(self.power_end)}"
+
+    def __str__(self)->str:
+        parts = [self._time_str(),"@",str(int(self.power_start)),'W']
+        if self.ramp_to:
+            parts.extend(['->',str(int(self.ramp_to)),'W'])
+
+        return ''.join(parts)
+
+    def _time_str(self)->str:
+        minutes,min_frac = divmod(self.time,1)
+        mntmp = []
+        if minutes:
+            mntmp.extend([str(int(minutes)),"'"])
+        if min_frac:
+            mntmp.extend([str(int(min_frac*60)),'"'])
+
+        return ''.join(mntmp)
+
+class SegmentView(SegmentFormat):
+    __slots__ = ('_table','_index')
+
+    def __init__(self,table:SegmentTable,index:int)->None:
+        self._table = table
+        self._index = index
+
+    def __repr__(self)->str:
+        return f"SegmentView({self})"
+
+    @property
+    def time(self)->float:
+        return self._table.time[self._index].item()
+
+    @property
+    def power_start(self)->float:
+        return self._table.power_start[self._index].item()
+
+    @property
+    def ramp_to(self)->float|None:
+        if self._table.ramped[self._index]:
+            return self._table.power_end[self._index].item()
+
+    @property
+    def power_end(self)->float:
+        return self._table.power_end[self._index].item()
+
+    @property
+    def exclude(self)->bool:
+        return bool(self._table.exclude[self._index])
+
+    @property
+    def start_time(self)->float:
+        return self._table.start_time[self._index].item()
+
+class SegmentTable:
+    #struct of arrays, one entry per segment, start times are kept in step with the times
+    __slots__ = ('time','power_start','power_end','ramped','exclude','start_time')
+
+    def __init__(self,time:Iterable[float],power_start:Iterable[float],power_end:Iterable[float],
+                 ramped:Iterable[bool],exclude:Iterable[bool])->None:
+        self.time = np.asarray(time,dtype=np.float64)
+        self.power_start = np.asarray(power_start,dtype=np.float64)
+        self.power_end = np.asarray(power_end,dtype=np.float64)
+        self.ramped = np.asarray(ramped,dtype=bool)
+        self.exclude = np.asarray(exclude,dtype=bool)
+        self.start_time = np.concatenate(([0.0],np.cumsum(self.time[:-1])))[:len(self.time)]
+
+    def __getstate__(self)->tuple:
+        return tuple(getattr(self,k) for k in self.__slots__)
+
+    def __setstate__(self,state:tuple)->None:
+        for k,v in zip(self.__slots__,state):
+            setattr(self,k,v)
+
+    @classmethod
+    def from_segments(cls,segments:Iterable)->SegmentTable:
+        #anything with time/power_start/ramp_to/exclude, i.e. validated excel rows
+        segments = list(segments)
+        return cls(time=[seg.time for seg in segments],
+                   power_start=[seg.power_start for seg in segments],
+                   power_end=[seg.power_end for seg in segments],
+                   ramped=[bool(seg.ramp_to) for seg in segments],
+                   exclude=[bool(seg.exclude) for seg in segments])
+
+    @classmethod
+    def from_rows(cls,rows:Iterable[tuple])->SegmentTable:
+        #(time,power_start,ramp_to,exclude) tuples, the same columns without building a row model for each
+        rows = list(rows)
+        return cls(time=[row[0] for row in rows],
+                   power_start=[row[1] for row in rows],
+                   power_end=[row[2] or row[1] for row in rows],
+                   ramped=[bool(row[2]) for row in rows],
+                   exclude=[bool(row[3]) for row in rows])
+
+    @classmethod
+    def ramp(cls,time:float,power_start:float,power_end:float)->SegmentTable:
+        return cls([time],[power_start],[power_end],[bool(power_end)],[False])
+
+    @classmethod
+    def concat(cls,tables:Iterable[SegmentTable])->SegmentTable:
+        tables = list(tables)
+        return cls(*[np.concatenate([getattr(t,k) for t in tables]) for k in cls.__slots__[:-1]])
+
+    def repeat(self,n:int)->SegmentTable:
+        return type(self)(*[np.tile(getattr(self,k),n) for k in self.__slots__[:-1]])
+
+    def strip_excluded(self)->SegmentTable:
+        #drop the trailing run of segments marked 'exclude from last repeat'
+        keep = len(self)
+        while keep and self.exclude[keep-1]:
+            keep-=1
+        return self[:keep]
+
+    @property
+    def end_time(self)->float:
+        if len(self):
+            return float(self.start_time[-1]+self.time[-1])
+        return 0.0
+
+    @staticmethod
+    def _erg_fmt(values:np.ndarray)->np.ndarray:
+        #SegmentFormat._erg_fmt for a whole column, whole numbers bare, the rest to one decimal place
+        return np.where(np.mod(values,1) == 0,np.char.mod('%d',values),np.char.mod('%.1f',values))
+
+    def erg_chunks(self,batch:int=4096)->Iterator[str]:
+        #the segment lines of an erg file, 'batch' segments per chunk, chunks still need joining with a newline
+        for first in range(0,len(self),batch):
+            rows = slice(first,first+batch)
+            start = self.start_time[rows]
+            columns = (self._erg_fmt(start),np.char.mod('%d',self.power_start[rows].astype(np.int64)),
+                       self._erg_fmt(start+self.time[rows]),np.char.mod('%d',self.power_end[rows].astype(np.int64)))
+            lines = columns[0]
+            for sep,column in zip(('\t','\n','\t'),columns[1:]):
+                lines = np.char.add(np.char.add(lines,sep),column)
+            yield '\n'.join(lines.tolist())
+
+    def __len__(self)->int:
+        return len(self.time)
+
+    def __bool__(self)->bool:
+        return len(self) > 0
+
+    def __getitem__(self,index:int|slice)->SegmentView|SegmentTable:
+        if isinstance(index,slice):
+            return type(self)(*[getattr(self,k)[index] for k in self.__slots__[:-1]])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return SegmentView(self,index)
+
+    def __iter__(self)->Iterator[SegmentView]:
+        for i in range(len(self)):
+            yield SegmentView(self,i)
+
+class SegmentBlock(ABC):
+    #immutable piece of a course, composed blocks share their children and only become a table when asked
+    __slots__ = ()
+    _columns_slots = SegmentTable.__slots__[:-1]
+
+    @abstractmethod
+    def columns(self)->tuple[np.ndarray,...]:
+        ...
+
+    def table(self)->SegmentTable:
+        return SegmentTable(*self.columns())
+
+    @property
+    @abstractmethod
+    def power_first(self)->float:
+        ...
+
+    @property
+    @abstractmethod
+    def power_last(self)->float:
+        ...
+
+    @abstractmethod
+    def __len__(self)->int:
+        ...
+
+class TableBlock(SegmentBlock):
+    __slots__ = ('_columns',)
+
+    def __init__(self,table:SegmentTable)->None:
+        columns = tuple(getattr(table,k) for k in self._columns_slots)
+        for column in columns:
+            column.flags.writeable = False
+        self._columns = columns
+
+    def columns(self)->tuple[np.ndarray,...]:
+        return self._columns
+
+    @property
+    def power_first(self)->float:
+        return self._columns[1][0].item()
+
+    @property
+    def power_last(self)->float:
+        return self._columns[2][-1].item()
+
+    def __len__(self)->int:
+        return len(self._columns[0])
+
+    def strip_excluded(self)->TableBlock:
+        #numpy slices are views, the stripped block still shares the original arrays
+        keep = len(self)
+        while keep and self._columns[4][keep-1]:
+            keep-=1
+        block = object.__new__(TableBlock)
+        block._columns = tuple(column[:keep] for column in self._columns)
+        return block
+
+class RepeatBlock(SegmentBlock):
+    __slots__ = ('block','n')
+
+    def __init__(self,block:SegmentBlock,n:int)->None:
+        self.block = block
+        self.n = n
+
+    def columns(self)->tuple[np.ndarray,...]:
+        return tuple(np.tile(column,self.n) for column in self.block.columns())
+
+    @property
+    def power_first(self)->float:
+        return self.block.power_first
+
+    @property
+    def power_last(self)->float:
+        return self.block.power_last
+
+    def __len__(self)->int:
+        return len(self.block)*self.n
+
+class ConcatBlock(SegmentBlock):
+    __slots__ = ('blocks','_len')
+
+    def __init__(self,blocks:Iterable[SegmentBlock])->None:
+        #a concat inside a concat is spliced in, so however long a chain of inserts gets the tree stays one level deep
+        flat = []
+        for block in blocks:
+            if isinstance(block,ConcatBlock):
+                flat.extend(block.blocks)
+            elif len(block):
+                flat.append(block)
+        self.blocks = tuple(flat)
+        self._len = sum(len(block) for block in self.blocks)
+
+    def columns(self)->tuple[np.ndarray,...]:
+        if not self.blocks:
+            return TableBlock(SegmentTable([],[],[],[],[])).columns()
+        parts = [block.columns() for block in self.blocks]
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    @property
+    def power_first(self)->float:
+        return self.blocks[0].power_first
+
+    @property
+    def power_last(self)->float:
+        return self.blocks[-1].power_last
+
+    def __len__(self)->int:
+        return self._len
+
+def repeat(block:TableBlock,n:int)->SegmentBlock:
+    #trailing 'exclude from last repeat' segments only come off the final copy
+    last = block.strip_excluded()
+    if n <= 1:
+        return last
+    if not len(last):
+        #everything is excluded, the strip runs on into the earlier repeats
+        return TableBlock(RepeatBlock(block,n).table().strip_excluded())
+    return ConcatBlock([RepeatBlock(block,n-1),last])
+
+def concat(*blocks:SegmentBlock)->ConcatBlock:
+    return ConcatBlock(blocks)
+
+def blend(time:float,power_start:float,power_end:float)->TableBlock:
+    return TableBlock(SegmentTable.ramp(time,power_start,power_end))
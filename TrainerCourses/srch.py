@@ -18,9 +18,10 @@ def qkfltr(s:Iterable[str],
 
     if not case_sens:
         _case = lambda x:x.lower()
-        for iterable_arg in (include,exclude):
-            if iterable_arg:
-                iterable_arg = [e.lower() for e in iterable_arg]
+        if include:
+            include = [e.lower() for e in _val(include)]
+        if exclude:
+            exclude = [e.lower() for e in _val(exclude)]
     else:
         _case = lambda x:x
     
@@ -66,7 +67,6 @@ def qkfltr(s:Iterable[str],
             elif ex_element.startswith('*'):
                 exclude_lmds.append((lambda a,b:_case(a).endswith(b[1:]),ex_element))
             elif ex_element.endswith('*'):
-                print(ex_element[:-1])
                 exclude_lmds.append((lambda a,b:_case(a).startswith(b[:-1]),ex_element))
             else:
                 exclude_lmds.append((lambda a,b:_case(a)==b,ex_element))
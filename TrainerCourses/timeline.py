@@ -0,0 +1,160 @@
+from __future__ import annotations
+import numpy as np
+from typing import Iterable
+from .segments import SegmentTable
+
+def segment_seconds(times:Iterable[float])->np.ndarray:
+    #same rounding as the old per-second loop, int(round(60*time))
+    return np.rint(60*np.asarray(times,dtype=np.float64)).astype(np.int64)
+
+def power_timeline(segments:SegmentTable|Iterable)->np.ndarray:
+    if not isinstance(segments,SegmentTable):
+        segments = SegmentTable.from_segments(segments)
+    if not segments:
+        return np.zeros(0,dtype=np.float64)
+    lengths = segment_seconds(segments.time)
+    power_start,power_end = segments.power_start,segments.power_end
+
+    total = int(lengths.sum())
+    offsets = np.cumsum(lengths) - lengths
+    second = np.arange(total,dtype=np.float64) - np.repeat(offsets,lengths)
+    return np.repeat(power_start,lengths) + \
+        second/np.repeat(lengths,lengths)*np.repeat(power_end-power_start,lengths)
+
+def power_curve(pbs:np.ndarray,durations:Iterable[int]|None=None)->np.ndarray:
+    #mean-maximal power for each duration (seconds), nan where the timeline is shorter than the duration
+    pbs = np.asarray(pbs,dtype=np.float64)
+    n = len(pbs)
+    if durations is None:
+        durations = np.arange(1,n+1)
+    durations = np.asarray(durations,dtype=np.int64)
+    curve = np.full(len(durations),np.nan)
+    if not n:
+        return curve
+    #offset by the mean so the running total stays small on long courses
+    csum = np.concatenate(([0.0],np.cumsum(pbs-pbs.mean())))
+    for c,w in enumerate(durations):
+        if 0 < w <= n:
+            start = int(np.argmax(csum[w:]-csum[:-w]))
+            #re-sum the winning window so near-integer averages don't pick up prefix-sum error
+            curve[c] = pbs[start:start+w].mean()
+    return curve
+
+def rolling_power(pbs:np.ndarray,window:int=30,exponential:bool=False)->np.ndarray:
+    pbs = np.asarray(pbs,dtype=np.float64)
+    window = max(1,min(int(window),len(pbs)))
+    if not exponential:
+        return np.convolve(pbs,np.ones(window),'valid')/window
+    #ewma with time constant 'window', kernel cut off once the weights drop below 1e-12
+    decay = 1.0 - 1.0/window
+    length = len(pbs)
+    if decay:
+        length = min(length,int(np.log(1e-12)/np.log(decay))+1)
+    kernel = decay**np.arange(length)
+    #normalise by the kernel mass actually covered so the first seconds aren't biased toward 0W
+    weights = np.convolve(np.ones(len(pbs)),kernel)[:len(pbs)]
+    return np.convolve(pbs,kernel)[:len(pbs)]/weights
+
+def normalized_power(pbs:np.ndarray,window:int=30,exponential:bool=False)->float:
+    if not len(pbs):
+        return 0.0
+    rolling = rolling_power(pbs,window,exponential)
+    return float(np.mean(rolling**4)**(1/4))
+
+#5 point gauss-legendre is exact up to degree 9, enough for a quadratic rolling average raised to the 4th
+_GL_NODES,_GL_WEIGHTS = np.polynomial.legendre.leggauss(5)
+
+class PiecewiseTimeline:
+    #closed form view of a course, every segment is a constant or a linear ramp so nothing is sampled
+    def __init__(self,segments:SegmentTable|Iterable)->None:
+        if not isinstance(segments,SegmentTable):
+            segments = SegmentTable.from_segments(segments)
+        durations = 60*segments.time
+        self.breaks = np.concatenate(([0.0],np.cumsum(durations)))
+        self.power_start = segments.power_start
+        self.power_end = segments.power_end
+        with np.errstate(divide='ignore',invalid='ignore'):
+            self.slope = np.where(durations>0,(self.power_end-self.power_start)/durations,0.0)
+        self.cumulative_work = np.concatenate(([0.0],np.cumsum(durations*(self.power_start+self.power_end)/2)))
+
+    @property
+    def duration(self)->float:
+        return float(self.breaks[-1])
+
+    @property
+    def work(self)->float:
+        return float(self.cumulative_work[-1])
+
+    def average(self)->float:
+        if not self.duration:
+            return 0.0
+        return self.work/self.duration
+
+    def integral(self,t:np.ndarray)->np.ndarray:
+        #joules done from 0 to t
+        t = np.clip(np.asarray(t,dtype=np.float64),0.0,self.duration)
+        i = np.clip(np.searchsorted(self.breaks,t,side='right')-1,0,len(self.slope)-1)
+        dt = t-self.breaks[i]
+        return self.cumulative_work[i] + self.power_start[i]*dt + self.slope[i]*dt*dt/2
+
+    def _window_pieces(self,window:float)->np.ndarray:
+        #the rolling integral is quadratic between these points
+        edges = np.concatenate((self.breaks,self.breaks+window))
+        edges = edges[(edges>=window) & (edges<=self.duration)]
+        return np.unique(np.concatenate((edges,[window,self.duration])))
+
+    def rolling(self,t:np.ndarray,window:float)->np.ndarray:
+        return (self.integral(t)-self.integral(t-window))/window
+
+    def normalized_power(self,window:int=30)->float:
+        if not self.duration:
+            return 0.0
+        window = min(float(window),self.duration)
+        edges = self._window_pieces(window)
+        if len(edges)<2:
+            return self.average()
+        lo,hi = edges[:-1,None],edges[1:,None]
+        nodes = (lo+hi)/2 + (hi-lo)/2*_GL_NODES
+        fourth = ((hi-lo)[:,0]/2*(self.rolling(nodes,window)**4 @ _GL_WEIGHTS)).sum()
+        return float((fourth/(self.duration-window))**(1/4))
+
+    def time_in_zones(self,edges:Iterable[float])->np.ndarray:
+        #seconds spent between consecutive edges (watts), len(edges)+1 zones, ramps split by how much of them each zone covers
+        edges = np.asarray(edges,dtype=np.float64)
+        durations = np.diff(self.breaks)
+        low = np.minimum(self.power_start,self.power_end)[:,None]
+        high = np.maximum(self.power_start,self.power_end)[:,None]
+        lower = np.concatenate(([-np.inf],edges))[None,:]
+        upper = np.concatenate((edges,[np.inf]))[None,:]
+        span = high-low
+        with np.errstate(divide='ignore',invalid='ignore'):
+            covered = np.clip(np.minimum(high,upper)-np.maximum(low,lower),0.0,None)/span
+        #flat segments sit wholly in one zone, a power right on an edge belongs to the zone below
+        flat = ((low>lower) & (low<=upper)).astype(np.float64)
+        share = np.where(span>0,covered,flat)
+        return durations @ share
+
+    def power_curve(self,durations:Iterable[float])->np.ndarray:
+        durations = np.asarray(durations,dtype=np.float64)
+        curve = np.full(len(durations),np.nan)
+        for c,w in enumerate(durations):
+            if 0 < w <= self.duration:
+                edges = self._window_pieces(w)
+                #rolling average is quadratic on each piece so check the ends and any interior vertex
+                lo,hi = edges[:-1],edges[1:]
+                mid = (lo+hi)/2
+                f0,f1,f2 = self.rolling(lo,w),self.rolling(mid,w),self.rolling(hi,w)
+                curvature = f0-2*f1+f2
+                with np.errstate(divide='ignore',invalid='ignore'):
+                    x = np.where(curvature<0,(f0-f2)/(4*curvature),0.0)
+                vertex = self.rolling(np.clip(mid+x*(hi-lo),lo,hi),w)
+                curve[c] = max(f0.max(initial=self.rolling(w,w)),f2.max(initial=-np.inf),vertex.max(initial=-np.inf))
+        return curve
+
+def power_timelines(tables:Iterable[SegmentTable])->tuple[np.ndarray,np.ndarray]:
+    #every course back to back in one flat array, whole seconds per segment so nothing bleeds between courses
+    tables = list(tables)
+    lengths = np.array([segment_seconds(table.time).sum() for table in tables],dtype=np.int64)
+    if not tables:
+        return np.zeros(0,dtype=np.float64),lengths
+    return power_timeline(SegmentTable.concat(tables)),lengths
@@ -20,5 +20,126 @@ def test3():
    # print(cc.summary())
     cc.save(os.getcwd() +'\\' + r'dev\output2')
 
+def test4():
+    #analytic stats should agree with the per-second reference within sampling error
+    cc = CourseCollection.open_excel(path)
+    for course in cc:
+        sampled = course.compute_stats(analytic=False)
+        analytic = course.compute_stats(analytic=True)
+        for key in ('average','np'):
+            a,b = getattr(sampled,key),getattr(analytic,key)
+            assert abs(a-b) <= 0.01*a, f"{course.version_name} {key} sampled={a} analytic={b}"
+        for window,power in sampled.power_averages.items():
+            if power is None:
+                assert analytic.power_averages[window] is None
+            else:
+                assert abs(power-analytic.power_averages[window]) <= 0.02*power, (course.version_name,window)
+
+def test5():
+    #the batched pass has to give exactly what each course computes on its own
+    cc = CourseCollection.open_excel(path)
+    single = {course.version_name:course.compute_stats() for course in cc}
+    cc.compute_stats(force=True)
+    for course in cc:
+        assert course.stats == single[course.version_name], (course.version_name,course.stats,single[course.version_name])
+
+def test6():
+    #an export read back in gives the same course data, apart from segments the erg rounds down to nothing
+    import tempfile
+    from pathlib import Path
+    cc = CourseCollection.open_excel(path)
+    with tempfile.TemporaryDirectory() as tmp:
+        for course in cc:
+            course.save(Path(tmp))
+        back = CourseCollection.open_erg(tmp,workers=2)
+    assert sorted(back.course_names) == sorted(cc.course_names)
+    for course in cc:
+        read = back[course.version_name]
+        assert read.category == course.category, course.version_name
+        if (course.segments.time >= 0.1).all():
+            data = [c.erg.partition('[COURSE DATA]')[2] for c in (course,read)]
+            assert data[0].replace('.0\t','\t') == data[1].replace('.0\t','\t'), course.version_name
+
+def test7():
+    #the text copy of a workbook loads into the same courses
+    import tempfile
+    from pathlib import Path
+    cc = CourseCollection.open_excel(path)
+    with tempfile.TemporaryDirectory() as tmp:
+        text = CourseCollection.open_text(CourseCollection.xlsx_to_text(path,Path(tmp) / 'Collection1.courses'))
+    assert list(text.course_names) == list(cc.course_names)
+    for course in cc:
+        assert course.erg == text[course.version_name].erg, course.version_name
+
+def test8():
+    #a collection split over two files links across them once merged
+    import tempfile
+    from pathlib import Path
+    from trainercourses.coursetext import TextCollection,read_text_file,write_text
+    cc = CourseCollection.open_excel(path)
+    with tempfile.TemporaryDirectory() as tmp:
+        text = read_text_file(CourseCollection.xlsx_to_text(path,Path(tmp) / 'All.courses'))
+        half = len(text.sheets)//2
+        paths = [Path(tmp) / 'A.courses',Path(tmp) / 'B.courses']
+        for pth,sheets in zip(paths,(text.sheets[:half],text.sheets[half:])):
+            with open(pth,'w') as f:
+                write_text(f,TextCollection(config=text.config,sheets=sheets))
+        merged = CourseCollection.open_many(paths,workers=2)
+    assert sorted(merged.course_names) == sorted(cc.course_names)
+    for course in cc:
+        assert course.erg == merged[course.version_name].erg, course.version_name
+
+#time trainercourses.course may take to import on top of numpy and pydantic, which it can't do without
+IMPORT_BUDGET_MS = 100
+
+def test9():
+    #import time benchmark, the package has to load without openpyxl and main.py --help without the package
+    import re
+    import sys
+    import subprocess
+    def importtime(*args):
+        run = subprocess.run([sys.executable,'-X','importtime',*args],capture_output=True,text=True)
+        return {name.strip():int(total) for (total,name) in \
+                re.findall(r'^import time:\s*\d+\s*\|\s*(\d+)\s*\|(.*)$',run.stderr,re.MULTILINE)}
+    #best of a few runs, the first one also pays for a cold disk cache
+    runs = [importtime('-c','import trainercourses.course') for _ in range(3)]
+    modules = runs[-1]
+    dependencies = min(run['numpy']+run['pydantic'] for run in (importtime('-c','import numpy, pydantic') for _ in range(3)))
+    elapsed = (min(run['trainercourses.course'] for run in runs)-dependencies)/1000
+    print(f"import trainercourses.course : {elapsed:.0f}ms over numpy and pydantic (budget {IMPORT_BUDGET_MS}ms)")
+    assert elapsed < IMPORT_BUDGET_MS, elapsed
+    assert not any(name.startswith('openpyxl') for name in modules)
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)),'main.py')
+    assert not any(name.startswith('trainercourses') for name in importtime(main,'--help'))
+
+def test10():
+    #every cycle and missing target is in the one error, and a chain deeper than the recursion limit still resolves
+    import sys
+    import tempfile
+    from pathlib import Path
+    with tempfile.TemporaryDirectory() as tmp:
+        pth = Path(tmp) / 'Broken.courses'
+        pth.write_text("[Config]\nftp = 250\n\n"
+                       "[A]\ncategory = Warmup\nbefore = B\n10' @ 200W\n\n"
+                       "[B]\ncategory = Warmup\nbefore = A\n5' @ 150W\n\n"
+                       "[Self]\ncategory = Warmup\nafter = Self\n5' @ 150W\n\n"
+                       "[Orphan]\ncategory = Warmup\nbefore = Nowhere\n5' @ 150W\n")
+        try:
+            CourseCollection.open_text(pth)
+        except Exception as e:
+            message = str(e)
+        else:
+            assert False, "linked a collection with cycles"
+        assert "circular insert A -> B -> A" in message, message
+        assert "circular insert Self -> Self" in message, message
+        assert "'Orphan' inserts 'Nowhere'" in message, message
+        depth = sys.getrecursionlimit()+100
+        pth = Path(tmp) / 'Chain.courses'
+        pth.write_text("[Config]\nftp = 250\n\n"+
+                       ''.join(f"[C{i}]\ncategory = Warmup\nbefore = C{i+1}\n1' @ 100W\n\n" for i in range(depth))+
+                       f"[C{depth}]\ncategory = Warmup\n1' @ 100W\n")
+        chain = CourseCollection.open_text(pth)
+    assert len(chain['C0'].segments) == depth+1
+
 test3()
 
@@ -1,7 +1,7 @@
 import os
 import sys
+import glob
 import argparse
-from trainercourses.course import CourseCollection
 from pathlib import Path
 
 
@@ -15,7 +15,9 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--include', type=str.lower,nargs='+',required=False,help="Courses to include.  Example: *course name* *another course name*")
     parser.add_argument('--exclude', type=str.lower,nargs='+',required=False,help="Courses to exclude.  Example: *course name* *another course name*")
-    parser.add_argument('--src',type=Path,help='Path (relative or absolute) to xlsx course collection.')
+    parser.add_argument('--where',type=str,required=False,help="Only courses matching a query.  Example: \"tss>80 and category=Sweet Spot\"")
+    parser.add_argument('--src',type=Path,nargs='+',help='Path (relative or absolute) to xlsx or .courses course collection, or to .erg/.mrc files or a folder of them.  '+\
+                        'Several collections (or a glob like seasons/*.xlsx) are merged into one.')
     parser.add_argument('--dst',type=Path,help='Directory (relative or absolute) for exports.')
 
     parser.add_argument('-p','--print',action="store_true",
@@ -24,32 +26,78 @@ if __name__ == "__main__":
                         help="Update library sheet in xlsx file.")
     parser.add_argument('-e','--export',action="store_true",
                         help="Export to folder structure in $/export or in 'dst' directory if supplied")
+    parser.add_argument('-t','--to-text',action="store_true",
+                        help="Write the xlsx collection as a .courses text file next to it.")
     parser.add_argument('-f','--format',default='erg',
                         help="Export to what format?")
+    parser.add_argument('-j','--jobs',type=int,default=1,
+                        help="Number of worker processes to use when exporting.")
+    parser.add_argument('--force',action="store_true",
+                        help="Rewrite every exported file, even the ones the export manifest says are unchanged.")
+    parser.add_argument('--cache',action="store_true",
+                        help="Keep course stats in a cache file next to the xlsx so unchanged courses are not re-analysed.")
+    parser.add_argument('--no-snapshot',action="store_true",
+                        help="Always parse the xlsx instead of loading the compiled snapshot beside it.")
+    parser.add_argument('--analytic',action="store_true",
+                        help="Compute stats in closed form from the segments instead of sampling every second.")
+    parser.add_argument('--riders',action="store_true",
+                        help="Export once per rider on the Riders sheet, each into its own folder under the export directory.")
+    parser.add_argument('--ftp-list',type=str,nargs='+',required=False,
+                        help="Export once per FTP instead of the Riders sheet.  Example: 250 Alice=280 Bob=310")
+    parser.add_argument('--ftp',type=float,required=False,
+                        help="FTP to read .erg/.mrc sources with, by default the FTP in the file headers.")
    
     args = parser.parse_args()
+    #loading the package is most of the start up, --help and bad arguments never need it
+    from trainercourses.course import CourseCollection
     
     if not args.src:
-        source = Path(os.getcwd()) / 'Collection.xlsx'
+        sources = [Path(os.getcwd()) / 'Collection.xlsx']
         
     else:
-        source = Path(os.path.abspath(args.src))
+        #globs are expanded here as well, cmd.exe hands them over as they are
+        sources = [Path(os.path.abspath(pth)) for src in args.src for pth in \
+                   (sorted(glob.glob(str(src))) if glob.has_magic(str(src)) else [src])]
+    source = sources[0] if sources else Path(os.getcwd()) / 'Collection.xlsx'
 
-    if not source.exists():
+    if not sources or not all(pth.exists() for pth in sources):
         raise ValueError(f"Source not found.  Either specify a custom path to a Course Collection .xlsx file or make sure "+\
             f"the default file of $\Collection.xlsx exists.")
         sys.exit()
 
-    cc = CourseCollection.open_excel(source)
+    ergs = [pth.is_dir() or pth.suffix.lower() in ('.erg','.mrc') for pth in sources]
+    if any(ergs) and not all(ergs):
+        raise ValueError("Can't mix .erg/.mrc files or folders with xlsx/.courses collections in one --src.")
+
+    if all(ergs):
+        cc = CourseCollection.open_erg(sources,ftp=args.ftp,workers=args.jobs,cache=args.cache)
+    elif len(sources) > 1:
+        #one workbook per worker, links between them are resolved after the merge
+        cc = CourseCollection.open_many(sources,workers=args.jobs,cache=args.cache)
+    elif source.suffix.lower() == '.courses':
+        cc = CourseCollection.open_text(source,cache=args.cache)
+    else:
+        #with --include only the sheets behind the selected courses (and what they link to) get parsed
+        cc = CourseCollection.open_excel(source,cache=args.cache,snapshot=not args.no_snapshot,
+                                         lazy=bool(args.include))
+    cc.analytic_stats = args.analytic
     inc,exc = "",""
     if args.include:
         inc = f" (include: {','.join(args.include)})"
     if args.exclude:
         exc = f" (exclude: {','.join(args.exclude)})"
+    if args.where:
+        exc += f" (where: {args.where})"
     if args.print:
         print(f'Printing Courses...{inc}{exc}')
-        print(cc.summary(stats=True,include=args.include,exclude=args.exclude))
-    if args.build:
+        print(cc.summary(stats=True,include=args.include,exclude=args.exclude,where=args.where))
+    if args.to_text:
+        for pth in sources:
+            if pth.suffix.lower() == '.xlsx':
+                print('Writing',CourseCollection.xlsx_to_text(pth))
+    if args.build and (len(sources) > 1 or source.suffix.lower() != '.xlsx'):
+        print('Skipping Library tab, the source is not a single xlsx file')
+    elif args.build:
         print('Updating Library tab...')
         cc.build_library()
     if args.export:
@@ -63,5 +111,13 @@ if __name__ == "__main__":
                 dst.mkdir(parents=True)
             else:
                 sys.exit()
-        cc.save(dst=dst,include=args.include,exclude=args.exclude)
+        if args.ftp_list or args.riders:
+            riders = None
+            if args.ftp_list:
+                riders = [cc.UserProfile.from_arg(arg,zones=cc.user.zones) for arg in args.ftp_list]
+            cc.save_riders(dst=dst,riders=riders,include=args.include,exclude=args.exclude,
+                           workers=args.jobs,force=args.force,where=args.where)
+        else:
+            cc.save(dst=dst,include=args.include,exclude=args.exclude,workers=args.jobs,force=args.force,
+                    where=args.where)
 sys.exit()
\ No newline at end of file